@@ -0,0 +1,187 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import pygame
+
+# タイル画像のアトラス
+# すべてのタイルを横一列の1枚の画像にまとめ、各タイルはその部分画像（subsurface）として使う
+# セルの大きさに縮小したアトラスは元画像の内容のハッシュをキーにしてキャッシュし、次回からは画像の読み込みと縮小を省く
+# 不透明なタイルはconvert()、透明部分のあるタイルはconvert_alpha()したアトラスから切り出す
+
+IMAGE_FOLDER = "Images"
+ASSET_CACHE_DIR = os.path.join("cache", "assets")
+
+# タイルの名前、ファイル名、画像がない場合の色
+TileSpec = namedtuple("TileSpec", ["name", "file", "color"])
+# 読み込み結果（statusは "ok"、"case"（大文字小文字の違うファイルを使った）、"fallback"（色で代用した））
+AssetStatus = namedtuple("AssetStatus", ["name", "path", "status", "reason"])
+
+# ゲームで使うタイル
+TILE_SPECS = (
+    TileSpec("player", "player.png", (0, 0, 255)),
+    TileSpec("wall", "wall.png", (0, 0, 0)),
+    TileSpec("goal", "goal.png", (0, 255, 0)),
+    TileSpec("floor", "floor.png", (255, 255, 255)),
+    TileSpec("plus", "plus.png", (255, 215, 0)),   # 金色
+    TileSpec("minus", "minus.png", (128, 128, 128)),  # グレー
+)
+
+
+# 画像ファイルを探す（大文字小文字だけが違うファイルも探す）
+def resolve_asset(folder, filename):
+    path = os.path.join(folder, filename)
+    if os.path.isfile(path):
+        return path, "ok", ""
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return None, "fallback", f"{folder} がありません"
+    for name in names:
+        if name.lower() == filename.lower():
+            return os.path.join(folder, name), "case", f"{filename} の代わりに {name} を使用"
+    return None, "fallback", f"{filename} がありません"
+
+
+# 元画像の探索結果と、アトラスのキャッシュのキー（画像の内容と探索結果のハッシュ）
+def scan_assets(specs, folder, cell_size):
+    digest = hashlib.sha256(f"{cell_size}\0".encode('utf-8'))
+    sources = []
+    for spec in specs:
+        path, status, reason = resolve_asset(folder, spec.file)
+        data = None
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                path, status, reason = None, "fallback", str(e)
+        # 読み込み結果もキャッシュに入るので、パスと探索結果もキーに含める
+        digest.update(f"{spec.name}\0{spec.color}\0{path}\0{status}\0{reason}\0".encode('utf-8'))
+        digest.update(hashlib.sha256(data).digest() if data is not None else b"\0")
+        sources.append((spec, path, status, reason, data))
+    return digest.hexdigest()[:32], sources
+
+
+# アトラスの作成（透明度付きの画像、タイルごとの不透明かどうか、読み込み結果）
+def build_atlas(sources, cell_size):
+    strip = pygame.Surface((cell_size * len(sources), cell_size), pygame.SRCALPHA)
+    opaque = []
+    report = []
+    for index, (spec, path, status, reason, data) in enumerate(sources):
+        image = None
+        if data is not None:
+            try:
+                image = pygame.image.load(path)
+                image = pygame.transform.scale(image, (cell_size, cell_size))
+            except (pygame.error, ValueError) as e:
+                image = None
+                status, reason = "fallback", f"{os.path.basename(path)} を読み込めません: {e}"
+        if image is None:
+            image = pygame.Surface((cell_size, cell_size))
+            image.fill(spec.color)
+            image_opaque = True
+        else:
+            image_opaque = tile_is_opaque(image)
+        strip.blit(image, (index * cell_size, 0))
+        opaque.append(image_opaque)
+        report.append(AssetStatus(spec.name, path, status, reason))
+    return strip, opaque, report
+
+
+def tile_is_opaque(image):
+    if image.get_flags() & pygame.SRCALPHA == 0 and image.get_colorkey() is None:
+        return True
+    return min(pygame.image.tobytes(image, "RGBA")[3::4]) == 255
+
+
+def cache_paths(cache_folder, cell_size, key):
+    base = os.path.join(cache_folder, f"atlas_{cell_size}_{key}")
+    return base + ".rgba", base + ".json"
+
+
+# キャッシュの読み込み（ない場合や壊れている場合はNone）
+def load_cached_atlas(cache_folder, cell_size, key, count):
+    pixels_path, meta_path = cache_paths(cache_folder, cell_size, key)
+    try:
+        with open(meta_path, "r", encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(pixels_path, "rb") as f:
+            pixels = f.read()
+        if len(meta["opaque"]) != count or len(pixels) != cell_size * count * cell_size * 4:
+            return None
+        strip = pygame.image.frombytes(pixels, (cell_size * count, cell_size), "RGBA")
+        report = [AssetStatus(*status) for status in meta["report"]]
+        return strip, meta["opaque"], report
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+# キャッシュの書き込み（同じセルの大きさの古いキャッシュは消す）
+def save_cached_atlas(cache_folder, cell_size, key, strip, opaque, report):
+    os.makedirs(cache_folder, exist_ok=True)
+    pixels_path, meta_path = cache_paths(cache_folder, cell_size, key)
+    for old_path in glob.glob(os.path.join(cache_folder, f"atlas_{cell_size}_*")):
+        if old_path not in (pixels_path, meta_path):
+            os.remove(old_path)
+    for path, data in ((pixels_path, pygame.image.tobytes(strip, "RGBA")),
+                       (meta_path, json.dumps({"opaque": opaque, "report": report}, ensure_ascii=False).encode('utf-8'))):
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+class TileAtlas:
+    def __init__(self, strip, opaque, report, cell_size, cached=False):
+        self.cell_size = cell_size
+        self.report = report
+        self.cached = cached
+        # 画面が作られていれば画面の形式に変換する（不透明な画像の方が描画が速い）
+        if pygame.display.get_surface() is not None:
+            self.opaque_atlas = strip.convert() if any(opaque) else None
+            self.alpha_atlas = strip.convert_alpha() if not all(opaque) else None
+        else:
+            self.opaque_atlas = self.alpha_atlas = strip
+        self.tiles = {}
+        for index, (status, tile_opaque) in enumerate(zip(report, opaque)):
+            atlas = self.opaque_atlas if tile_opaque else self.alpha_atlas
+            self.tiles[status.name] = atlas.subsurface((index * cell_size, 0, cell_size, cell_size))
+
+    # 代用や別名のファイルを使ったタイル
+    def problems(self):
+        return [status for status in self.report if status.status != "ok"]
+
+
+# タイル画像の読み込み（キャッシュがあればそれを使う）
+def load_atlas(specs=TILE_SPECS, folder=IMAGE_FOLDER, cell_size=40, cache_folder=ASSET_CACHE_DIR):
+    key, sources = scan_assets(specs, folder, cell_size)
+    cached = load_cached_atlas(cache_folder, cell_size, key, len(specs))
+    if cached is not None:
+        return TileAtlas(*cached, cell_size, cached=True)
+    strip, opaque, report = build_atlas(sources, cell_size)
+    try:
+        save_cached_atlas(cache_folder, cell_size, key, strip, opaque, report)
+    except OSError:
+        pass
+    return TileAtlas(strip, opaque, report, cell_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="タイル画像の読み込み結果を表示する")
+    parser.add_argument("folder", nargs="?", default=IMAGE_FOLDER)
+    parser.add_argument("--cell-size", type=int, default=40)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    key, sources = scan_assets(TILE_SPECS, args.folder, args.cell_size)
+    strip, opaque, report = build_atlas(sources, args.cell_size)
+    if args.json:
+        print(json.dumps([dict(status._asdict(), opaque=tile_opaque) for status, tile_opaque in zip(report, opaque)], ensure_ascii=False, indent=4))
+    else:
+        for status, tile_opaque in zip(report, opaque):
+            kind = "不透明" if tile_opaque else "透明あり"
+            print(f"{status.name:8s} {status.status:8s} {kind:6s} {status.path or '-'} {status.reason}")
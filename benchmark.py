@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# 画面のない環境でも動くようにダミーのビデオドライバーを使う
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+import engine
+import solver
+from level_pack import open_pack
+from levels import CELL_CHARS, FLOOR, WALL, START, GOAL, PLUS, MINUS, load_stages, make_stage
+from renderer import DirtyRenderer, MazeCache, draw_maze, follow_camera
+from text_cache import TextCache
+from vec_env import VecEnv
+
+# 性能測定（ステージ読み込み、描画、ルール計算）
+# 結果はJSONに書き出し、--compareで前回の結果と比べる
+
+CELL_SIZE = 40
+VIEW_SIZE = (400, 400)
+SCREEN_SIZE = (400, 450)
+
+
+# fnを繰り返し実行し、1回あたりの秒数の中央値を返す
+def measure(fn, repeat=5, number=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return statistics.median(times)
+
+
+# ランダムな迷路の配列
+def random_grid(worlds, height, width, rng):
+    grid = rng.choice(np.array([FLOOR, FLOOR, FLOOR, WALL, PLUS, MINUS], dtype=np.uint8), size=(worlds, height, width))
+    grid[0, 0, 0] = START
+    grid[0, height - 1, width - 1] = GOAL
+    return grid
+
+
+def random_stage(worlds, height, width, rng, name="bench"):
+    return make_stage(name, random_grid(worlds, height, width, rng), [int(rng.integers(1, 6)) for _ in range(worlds)], 0)
+
+
+# 合成したWorlds/フォルダを作る
+def write_worlds(folder, stage_count, size, rng):
+    for stage_index in range(stage_count):
+        stage_path = os.path.join(folder, f"Stage{stage_index:05d}")
+        os.makedirs(stage_path)
+        grid = random_grid(3, size, size, rng)
+        for world in range(3):
+            rows = ["".join(CELL_CHARS[cell] for cell in row) for row in grid[world].tolist()]
+            with open(os.path.join(stage_path, f"world{world + 1}.txt"), "w", encoding='utf-8') as f:
+                f.write(f"{rng.integers(1, 6)}\n" + "\n".join(rows) + "\n")
+
+
+def tile_images():
+    colors = {FLOOR: (255, 255, 255), WALL: (0, 0, 0), START: (255, 255, 255), GOAL: (0, 255, 0), PLUS: (255, 215, 0), MINUS: (128, 128, 128)}
+    images = {}
+    for cell, color in colors.items():
+        image = pygame.Surface((CELL_SIZE, CELL_SIZE))
+        image.fill(color)
+        images[cell] = image
+    return images
+
+
+def bench_loading(results, rng, quick):
+    for stage_count in ((10, 100) if quick else (10, 100, 1000)):
+        with tempfile.TemporaryDirectory() as folder:
+            worlds_folder = os.path.join(folder, "Worlds")
+            write_worlds(worlds_folder, stage_count, 10, rng)
+            pack_path = os.path.join(folder, "levels.pack")
+            results[f"load_stages[{stage_count} stages]"] = measure(lambda: load_stages(worlds_folder), repeat=3)
+            open_pack(worlds_folder, pack_path).close()
+            results[f"open_pack cached[{stage_count} stages]"] = measure(lambda: open_pack(worlds_folder, pack_path).close(), repeat=3)
+
+
+def bench_rendering(results, rng, quick):
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+    images = tile_images()
+    font = pygame.font.SysFont(None, 24)
+    for size in ((10, 50) if quick else (10, 50, 200, 500)):
+        stage = random_stage(2, size, size, rng)
+
+        # 迷路全体の描画（大きな迷路は画像が巨大になるので測らない）
+        if size <= 50:
+            surface = pygame.Surface((size * CELL_SIZE, size * CELL_SIZE))
+            results[f"draw_maze[{size}x{size}]"] = measure(lambda: draw_maze(surface, stage.grid[0], images, CELL_SIZE), number=5)
+
+        # 1フレームの合成（カメラが動いて背景を作り直す場合）
+        renderer = DirtyRenderer(screen)
+        maze_view = renderer.background.subsurface(pygame.Rect((0, 0), VIEW_SIZE))
+        maze_cache = MazeCache(images, CELL_SIZE)
+        text_cache = TextCache()
+        player = images[GOAL]
+        positions = [(x, size // 2) for x in range(size)]
+        frame = [0]
+
+        def compose_frame():
+            x, y = positions[frame[0] % len(positions)]
+            frame[0] += 1
+            camera = follow_camera(stage, x, y, CELL_SIZE, VIEW_SIZE)
+            renderer.background.fill((0, 0, 0))
+            maze_cache.draw_view(maze_view, stage, 0, camera)
+            renderer.invalidate()
+            status = text_cache.render(font, f"bench|世界1|次の変化まで:{x % 5}回", (0, 0, 0))
+            items = [(player, (x * CELL_SIZE - camera[0], y * CELL_SIZE - camera[1])), (status, (10, 10))]
+            pygame.display.update(renderer.render(items))
+
+        compose_frame()
+        results[f"frame[{size}x{size}]"] = measure(compose_frame, number=20)
+
+        # 世界の変化アニメーション用のSurfaceの作成
+        def transition_surfaces():
+            camera = follow_camera(stage, size // 2, size // 2, CELL_SIZE, VIEW_SIZE)
+            for world in (0, 1):
+                surface = pygame.Surface(VIEW_SIZE)
+                maze_cache.draw_view(surface, stage, world, camera)
+                surface.set_alpha(128)
+
+        results[f"transition_surfaces[{size}x{size}]"] = measure(transition_surfaces, number=20)
+
+
+def bench_rules(results, rng, quick):
+    # 壁とゴールのない迷路（埋まったりクリアしたりせずに動き続ける）
+    grid = rng.choice(np.array([FLOOR, FLOOR, FLOOR, PLUS, MINUS], dtype=np.uint8), size=(3, 10, 10))
+    grid[0, 0, 0] = START
+    stage = make_stage("rules", grid, [3, 2, 4], 0)
+    state = engine.initial_state(stage)
+    moves = 20000 if quick else 200000
+    actions = rng.integers(0, 4, size=moves).tolist()
+    seconds = measure(lambda: engine.run(stage, actions, state), repeat=3)
+    results["engine.step[moves/s]"] = moves / seconds
+
+    batch = 1000
+    states = [engine.run(stage, actions[:k], state) for k in range(batch)]
+    seconds = measure(lambda: engine.step_many(stage, states, actions[:batch]), number=20)
+    results["engine.step_many[moves/s]"] = batch / seconds
+
+    # numpyでまとめて進める場合（クリアや埋まったゲームは開始状態に戻す）
+    env = VecEnv(stage, 4096, auto_reset=True)
+    vec_actions = rng.integers(0, 4, size=(20, env.num_envs))
+
+    def vec_steps():
+        for step_actions in vec_actions:
+            env.step(step_actions)
+
+    seconds = measure(vec_steps, repeat=3)
+    results["vec_env.step[steps/s]"] = env.num_envs * len(vec_actions) / seconds
+
+    size = 50 if quick else 200
+    big = random_stage(2, size, size, rng)
+    results[f"solver.solve[{size}x{size}]"] = measure(lambda: solver.solve(big), repeat=3)
+
+
+# 値が大きいほど良い項目（1秒あたりの回数）
+def higher_is_better(name):
+    return name.endswith("/s]")
+
+
+# 前回の結果との比較（悪化した項目の名前を返す）
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not old:
+            print(f"{name:40s} {value:14.6g}  (新規)")
+            continue
+        ratio = value / old
+        worse = ratio < 1 - threshold if higher_is_better(name) else ratio > 1 + threshold
+        mark = "  悪化" if worse else ""
+        print(f"{name:40s} {value:14.6g}  前回 {old:14.6g}  x{ratio:.2f}{mark}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="読み込み、描画、ルール計算の性能測定")
+    parser.add_argument("-o", "--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--compare", help="比較する前回の結果のJSONファイル")
+    parser.add_argument("--threshold", type=float, default=0.2, help="悪化とみなす割合（既定は20%%）")
+    parser.add_argument("--quick", action="store_true", help="小さいサイズだけ測定する")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pygame.init()
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    bench_loading(results, rng, args.quick)
+    bench_rendering(results, rng, args.quick)
+    bench_rules(results, rng, args.quick)
+    pygame.quit()
+
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "pygame": pygame.version.ver,
+                "platform": platform.platform(),
+                "results": results,
+            }, f, ensure_ascii=False, indent=4)
+
+    if args.compare:
+        with open(args.compare, "r", encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}項目が悪化しました。")
+            sys.exit(1)
+    else:
+        for name, value in results.items():
+            print(f"{name:40s} {value:14.6g}")
@@ -0,0 +1,383 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+import engine
+import hints
+import leaderboard
+import replay
+import solver
+from history import KEYFRAME_INTERVAL, MAX_MOVES, History
+from levels import FLOOR, WALL, START, GOAL, PLUS, MINUS, make_stage
+from vec_env import VecEnv
+
+# ルールの整合性の確認
+# ランダムな小さいステージについて、engineだけを使った全探索の結果と、solverやhintsなどの高速化した実装の結果を比べる
+# VecEnvとengine.step_manyはengine.stepと1手ずつ、Historyとリプレイは状態をそのままリストに並べた素朴な実装と比べる
+# ランキングの提出の判定（leaderboard.verify_chunk）は、engineで1手ずつ動かした結果と比べる
+# ルールを変えたときは、これで他の実装がずれていないかを確かめる（ずれがあれば終了コード1）
+
+
+# ランダムな小さいステージ（世界の変化までの回数は0以下も含む。スタート位置に戻れないステージも作る）
+def random_stage(rng):
+    worlds = int(rng.integers(1, 4))
+    height = int(rng.integers(1, 9))
+    width = int(rng.integers(1, 9))
+    grid = rng.choice(np.array([FLOOR, FLOOR, FLOOR, WALL, WALL, PLUS, MINUS, GOAL, START], dtype=np.uint8), size=(worlds, height, width))
+    grid[0, int(rng.integers(height)), int(rng.integers(width))] = START
+    intervals = [int(rng.integers(-1, 6)) for _ in range(worlds)]
+    return make_stage("check", grid, intervals, int(rng.integers(0, 2)))
+
+
+# 状態を (位置, 世界, 残り手数, 埋まっているか, クリアしたか) にまとめたキー
+# move_countとchange_intervalは差だけがルールの結果に効く（solverやhintsと同じまとめ方）
+def state_key(state):
+    return (state.x, state.y, state.world, max(state.change_interval - state.move_count, 0), state.is_stuck, state.game_clear)
+
+
+# engineだけを使った全探索
+# 戻り値: 開始状態から行ける状態（キー -> 状態）と、各状態からクリアまでの最短手数（行けない状態は含まない）
+def explore(stage):
+    start = engine.initial_state(stage)
+    states = {state_key(start): start}
+    previous = defaultdict(list)
+    queue = deque([start])
+    while queue:
+        state = queue.popleft()
+        for action in range(4):
+            if engine.check_move(stage, state, action) != engine.MOVE_OK:
+                continue
+            next_state = engine.apply_move(stage, state, action)
+            key = state_key(next_state)
+            previous[key].append(state_key(state))
+            if key not in states:
+                states[key] = next_state
+                queue.append(next_state)
+
+    to_goal = {key: 0 for key in states if key[5]}
+    queue = deque(to_goal)
+    while queue:
+        key = queue.popleft()
+        for previous_key in previous[key]:
+            if previous_key not in to_goal:
+                to_goal[previous_key] = to_goal[key] + 1
+                queue.append(previous_key)
+    return states, to_goal
+
+
+# solverの最短手数が全探索と同じで、その手順が本当にクリアできるか
+def check_solver(stage, states, to_goal, rng, errors):
+    start = engine.initial_state(stage)
+    expected = to_goal.get(state_key(start))
+    actions = solver.solve(stage)
+    if actions is None or expected is None:
+        if actions is not None or expected is not None:
+            errors.append(f"solver: クリアできるかが違います（solver {actions}, 全探索 {expected}）")
+        return
+    if len(actions) != expected:
+        errors.append(f"solver: 手数が違います（solver {len(actions)}, 全探索 {expected}）")
+    state = start
+    for action in actions:
+        if engine.check_move(stage, state, action) != engine.MOVE_OK:
+            errors.append(f"solver: 移動できない手があります {solver.format_actions(actions)}")
+            return
+        state = engine.apply_move(stage, state, action)
+    if not state.game_clear:
+        errors.append(f"solver: 手順どおりに動いてもクリアしません {solver.format_actions(actions)}")
+
+
+# hintsの表の手数が行ける全状態で全探索と同じで、ヒントの手で1手近づくか
+def check_hints(stage, states, to_goal, rng, errors):
+    table = hints.HintTable(stage, hints.build_table(stage))
+    for key, state in states.items():
+        if state.is_stuck or state.game_clear:
+            continue
+        hint = table.lookup(state)
+        expected = to_goal.get(key)
+        if hint is None or expected is None:
+            if hint is not None or expected is not None:
+                errors.append(f"hints: {state} でクリアできるかが違います（hints {hint}, 全探索 {expected}）")
+            continue
+        action, distance = hint
+        if distance != expected:
+            errors.append(f"hints: {state} の手数が違います（hints {distance}, 全探索 {expected}）")
+        elif engine.check_move(stage, state, action) != engine.MOVE_OK:
+            errors.append(f"hints: {state} のヒントの手 {action} で移動できません")
+        elif to_goal.get(state_key(engine.apply_move(stage, state, action))) != expected - 1:
+            errors.append(f"hints: {state} のヒントの手 {action} で近づきません")
+
+
+# VecEnvの結果がengineと1手ずつ同じか（自動で開始状態に戻す場合も含む）
+def check_vec_env(stage, states, to_goal, rng, errors):
+    for auto_reset in (False, True):
+        env = VecEnv(stage, 16, auto_reset)
+        start = engine.initial_state(stage)
+        expected = [start] * env.num_envs
+        for step in range(40):
+            actions = rng.integers(0, 4, size=env.num_envs)
+            observations, result, clear, stuck = (values.tolist() for values in env.step(actions))
+            for i, action in enumerate(actions.tolist()):
+                state = expected[i]
+                move = engine.check_move(stage, state, action)
+                next_state = engine.step(stage, state, action)
+                if (move, next_state.game_clear and not state.game_clear, next_state.is_stuck and not state.is_stuck) != (result[i], clear[i], stuck[i]):
+                    errors.append(f"vec_env: {state} で手 {action} の結果が違います（VecEnv {result[i]}, engine {move}）")
+                    return
+                if observations[i] != [int(value) for value in next_state]:
+                    errors.append(f"vec_env: {state} で手 {action} の後の状態が違います（VecEnv {observations[i]}, engine {next_state}）")
+                    return
+                if auto_reset and (next_state.game_clear or next_state.is_stuck):
+                    next_state = start
+                if env.state(i) != next_state:
+                    errors.append(f"vec_env: 開始状態に戻した後の状態が違います（VecEnv {env.state(i)}, engine {next_state}）")
+                    return
+                expected[i] = next_state
+
+
+# engine.step_manyの結果がstepと同じか（行ける状態をまとめて1手ずつ進める。配列演算を使う数になるまで繰り返して並べる）
+def check_step_many(stage, states, to_goal, rng, errors):
+    states = list(states.values()) * (engine.STEP_MANY_VECTOR_MIN // len(states) + 1)
+    actions = rng.integers(0, 4, size=len(states)).tolist()
+    results = engine.step_many(stage, states, actions)
+    for state, action, result in zip(states, actions, results):
+        expected = engine.step(stage, state, action)
+        if result != expected:
+            errors.append(f"step_many: {state} で手 {action} の後の状態が違います（step_many {result}, step {expected}）")
+            return
+
+
+# 状態をすべてリストに並べた素朴な履歴（Historyと同じ手番号と古い手の捨て方）
+class ListHistory:
+    def __init__(self, state, max_moves, keyframe_interval):
+        self.states = [state]
+        self.max_moves = max_moves
+        self.keyframe_interval = keyframe_interval
+        self.base = 0
+        self.position = 0
+
+    @property
+    def end(self):
+        return len(self.states) - 1
+
+    def push(self, state):
+        del self.states[self.position + 1:]
+        self.states.append(state)
+        self.position += 1
+        if self.end - self.base > self.max_moves + self.keyframe_interval:
+            self.base += self.keyframe_interval
+
+    def undo(self):
+        if self.position > self.base:
+            self.position -= 1
+
+    def redo(self):
+        if self.position < self.end:
+            self.position += 1
+
+    def jump(self, index):
+        self.position = min(max(index, self.base), self.end)
+
+
+# Historyのundo/redo/jumpと古い手の破棄が、素朴な履歴と同じ状態を返すか
+def check_history(stage, states, to_goal, rng, errors):
+    start = engine.initial_state(stage)
+    max_moves = int(rng.integers(1, 20))
+    keyframe_interval = int(rng.integers(1, 6))
+    history = History(stage, start, max_moves, keyframe_interval)
+    expected = ListHistory(start, max_moves, keyframe_interval)
+    for step in range(200):
+        operation = int(rng.integers(0, 10))
+        state = expected.states[expected.position]
+        moves = [action for action in range(4) if engine.check_move(stage, state, action) == engine.MOVE_OK]
+        if operation < 6 and moves:
+            action = moves[int(rng.integers(len(moves)))]
+            next_state = engine.apply_move(stage, state, action)
+            history.push(action, next_state)
+            expected.push(next_state)
+            name = f"push {action}"
+        elif operation < 8:
+            history.undo()
+            expected.undo()
+            name = "undo"
+        elif operation < 9:
+            history.redo()
+            expected.redo()
+            name = "redo"
+        else:
+            index = int(rng.integers(expected.base - 2, expected.end + 3))
+            history.jump(index)
+            expected.jump(index)
+            name = f"jump {index}"
+        if (history.position, history.base, history.end) != (expected.position, expected.base, expected.end):
+            errors.append(f"history: {step}手目（{name}）の後の手番号が違います（History {(history.position, history.base, history.end)}, "
+                          f"リスト {(expected.position, expected.base, expected.end)}）")
+            return
+        if history.state != expected.states[expected.position]:
+            errors.append(f"history: {step}手目（{name}）の後の状態が違います（History {history.state}, リスト {expected.states[expected.position]}）")
+            return
+        index = int(rng.integers(expected.base, expected.end + 1))
+        if history.state_at(index) != expected.states[index]:
+            errors.append(f"history: {index}手目の状態が違います（History {history.state_at(index)}, リスト {expected.states[index]}）")
+            return
+
+
+# 操作を記録したファイルを読み込んで再生した結果が、その場で素朴な履歴で実行した結果と同じか
+def check_replay(stage, states, to_goal, rng, errors):
+    recorder = replay.ReplayRecorder()
+    records = []
+    selected = None
+    state = None
+    expected = None
+    moves = 0
+    rejected = 0
+    clear_ms = None
+    time_ms = 0
+    for step in range(100):
+        time_ms += int(rng.integers(0, 300))
+        operation = int(rng.integers(0, 12))
+        arg = 0
+        if operation < 1 or state is None and operation < 3:
+            code = replay.SELECT
+            arg = int(rng.integers(0, 2))  # 1は存在しないステージ
+        elif operation < 2:
+            code = replay.RESET
+        elif operation < 4:
+            code = replay.UNDO
+        elif operation < 5:
+            code = replay.REDO
+        else:
+            code = int(rng.integers(0, 4))
+        if code in (replay.SELECT, replay.RESET):
+            time_ms = 0  # 選択とリセットでステージの時刻は0に戻る
+        recorder.record(time_ms, code, arg)
+        records.append(replay.Record(time_ms, code, arg))
+
+        if code in (replay.SELECT, replay.RESET):
+            # 存在しないステージを選ぶと、その後のリセットも受け付けない
+            if code == replay.SELECT:
+                selected = arg
+            if selected != 0:
+                rejected += 1
+                continue
+            state = engine.initial_state(stage)
+            expected = ListHistory(state, MAX_MOVES, KEYFRAME_INTERVAL)
+            clear_ms = None
+        elif state is None:
+            rejected += 1
+        elif code == replay.UNDO or code == replay.REDO:
+            position = expected.position
+            if state.game_clear:
+                pass
+            elif code == replay.UNDO:
+                expected.undo()
+            else:
+                expected.redo()
+            if expected.position == position:
+                rejected += 1
+            state = expected.states[expected.position]
+        elif engine.check_move(stage, state, code) == engine.MOVE_OK:
+            state = engine.apply_move(stage, state, code)
+            expected.push(state)
+            moves += 1
+            if state.game_clear:
+                clear_ms = time_ms
+        else:
+            rejected += 1
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "check.swr")
+        recorder.save(path)
+        digest, loaded = replay.load_replay(path)
+    if loaded != records:
+        errors.append("replay: 読み込んだ操作が記録した操作と違います")
+        return
+    result = replay.run_replay(loaded, [stage])
+    if (result.state, result.moves, result.rejected, result.clear_ms) != (state, moves, rejected, clear_ms):
+        errors.append(f"replay: 再生結果が違います（再生 {(result.state, result.moves, result.rejected, result.clear_ms)}, "
+                      f"リスト {(state, moves, rejected, clear_ms)}）")
+
+
+# ランキングの提出の判定が、engineで1手ずつ動かした判定と同じか
+# 最短の解き方、その途中まで、その後に1手足したもの、ランダムな手の列、移動できる手だけを選んだ列を同時に確かめる
+def check_leaderboard(stage, states, to_goal, rng, errors):
+    action_lists = []
+    actions = solver.solve(stage)
+    if actions:
+        action_lists += [list(actions), list(actions[:-1]), list(actions) + [int(rng.integers(0, 4))]]
+    for _ in range(8):
+        action_lists.append(rng.integers(0, 4, size=int(rng.integers(1, 40))).tolist())
+    for _ in range(8):
+        state = engine.initial_state(stage)
+        walk = []
+        for _ in range(int(rng.integers(1, 40))):
+            moves = [action for action in range(4) if engine.check_move(stage, state, action) == engine.MOVE_OK]
+            if not moves:
+                break
+            walk.append(moves[int(rng.integers(len(moves)))])
+            state = engine.apply_move(stage, state, walk[-1])
+        action_lists.append(walk)
+    # 空の提出はverify_batchがverify_chunkに渡す前に断る
+    action_lists = [actions for actions in action_lists if actions]
+
+    verdicts = leaderboard.verify_chunk(stage, [np.array(actions, dtype=np.int8) for actions in action_lists])
+    for actions, verdict in zip(action_lists, verdicts):
+        state = engine.initial_state(stage)
+        expected = None
+        for t, action in enumerate(actions):
+            move = engine.check_move(stage, state, action)
+            if move != engine.MOVE_OK:
+                expected = (leaderboard.BLOCKED_REASONS.get(move, "blocked"), t)
+                break
+            state = engine.apply_move(stage, state, action)
+        if expected is None:
+            expected = (None, None) if state.game_clear else ("not_cleared", len(actions))
+        if verdict != expected:
+            errors.append(f"leaderboard: {solver.format_actions(actions)} の判定が違います（verify_chunk {verdict}, engine {expected}）")
+
+
+CHECKS = {
+    "solver": check_solver,
+    "hints": check_hints,
+    "vec_env": check_vec_env,
+    "step_many": check_step_many,
+    "history": check_history,
+    "replay": check_replay,
+    "leaderboard": check_leaderboard,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="solver、hints、VecEnv、History、リプレイ、ランキングの判定の結果がengineのルールと同じかを確かめる")
+    parser.add_argument("-n", "--count", type=int, default=300, help="確かめるステージの数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", choices=sorted(CHECKS), action="append", help="指定した項目だけ確かめる")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    checks = {name: CHECKS[name] for name in (args.only or CHECKS)}
+    failures = defaultdict(int)
+    checked = 0
+    start_time = time.perf_counter()
+    for index in range(args.count):
+        stage = random_stage(rng)
+        if stage.start is None:
+            continue
+        states, to_goal = explore(stage)
+        checked += 1
+        for name, check in checks.items():
+            errors = []
+            check(stage, states, to_goal, rng, errors)
+            if errors:
+                failures[name] += 1
+                print(f"{index}番目のステージ（{stage.intervals}, lock_start={stage.lock_start}）:")
+                for message in errors[:5]:
+                    print(f"  {message}")
+    seconds = time.perf_counter() - start_time
+    summary = "、".join(f"{name} {failures[name]}件" for name in checks)
+    print(f"{checked}ステージを確認しました（{seconds:.2f}秒）。不一致: {summary}")
+    sys.exit(1 if any(failures.values()) else 0)
@@ -0,0 +1,118 @@
+from collections import namedtuple
+
+from levels import WALL, START, GOAL, PLUS, MINUS, StageLoadError
+
+# ゲームのルール（pygameに依存しない）
+# 状態は不変のState、step(stage, state, action)で次の状態を返す
+
+# 行動（W, S, A, D）
+UP, DOWN, LEFT, RIGHT = range(4)
+DIRECTIONS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+# 移動判定の結果
+MOVE_OK = 0
+BLOCKED_CLEAR = 1   # クリア済み
+BLOCKED_STUCK = 2   # 壁に埋まっている
+BLOCKED_BOUNDS = 3  # 範囲外
+BLOCKED_WALL = 4    # 壁
+BLOCKED_START = 5   # スタート位置に戻れない
+
+# ゲーム状態
+State = namedtuple("State", ["x", "y", "world", "move_count", "change_interval", "is_stuck", "game_clear"])
+
+
+# ステージ開始時の状態
+def initial_state(stage):
+    if stage.start is None:
+        raise StageLoadError(f"{stage.name}のworld1.txtにスタート位置 'S' が見つかりません。")
+    x, y = stage.start
+    return State(x, y, 0, 0, stage.intervals[0], False, False)
+
+
+# 移動できるかの判定
+def check_move(stage, state, action):
+    if state.game_clear:
+        return BLOCKED_CLEAR
+    if state.is_stuck:
+        return BLOCKED_STUCK
+    dx, dy = DIRECTIONS[action]
+    new_x = state.x + dx
+    new_y = state.y + dy
+    width, height = stage.sizes[state.world]
+    if new_y < 0 or new_y >= height or new_x < 0 or new_x >= width:
+        return BLOCKED_BOUNDS
+    cell = stage.cells[(state.world * stage.height + new_y) * stage.width + new_x]
+    if cell == WALL:
+        return BLOCKED_WALL
+    if stage.lock_start and cell == START:
+        return BLOCKED_START
+    return MOVE_OK
+
+
+# 移動を確定させる（check_moveがMOVE_OKであること）
+def apply_move(stage, state, action):
+    dx, dy = DIRECTIONS[action]
+    x = state.x + dx
+    y = state.y + dy
+    world = state.world
+    move_count = state.move_count + 1
+    change_interval = state.change_interval
+    is_stuck = state.is_stuck
+
+    cell = stage.cells[(world * stage.height + y) * stage.width + x]
+    game_clear = cell == GOAL
+    if cell == PLUS:
+        change_interval += 1
+    elif cell == MINUS and change_interval > 1:
+        change_interval -= 1
+
+    # 世界の変化（変化後の世界の範囲外は壁として扱う）
+    if move_count >= change_interval and not game_clear:
+        move_count = 0
+        world = (world + 1) % len(stage.intervals)
+        change_interval = stage.intervals[world]
+        is_stuck = stage.cells[(world * stage.height + y) * stage.width + x] == WALL
+
+    return State(x, y, world, move_count, change_interval, is_stuck, game_clear)
+
+
+# 世界が変化した直後の状態か
+def world_changed(state):
+    return state.move_count == 0 and not state.game_clear
+
+
+# 世界が変化したときに壁に埋まるか（座標や世界は配列でもよい）
+def stuck_after_change(stage, world, x, y):
+    return stage.walls.reshape(-1)[((world + 1) % len(stage.intervals) * stage.height + y) * stage.width + x]
+
+
+# 1手進める（移動できない場合は同じ状態を返す）
+def step(stage, state, action):
+    if check_move(stage, state, action) != MOVE_OK:
+        return state
+    return apply_move(stage, state, action)
+
+
+# step_manyで配列演算を使う状態の数（これより少ないとVecEnvの準備と変換の分だけ遅くなる）
+STEP_MANY_VECTOR_MIN = 200
+
+
+# 複数の状態をそれぞれ1手進める（多い場合はVecEnvの配列演算でまとめて進める）
+# 同じゲームを何手も進める場合は、毎回Stateのリストとの変換をしないようにVecEnvを直接使う
+def step_many(stage, states, actions):
+    if len(states) < STEP_MANY_VECTOR_MIN:
+        return [step(stage, state, action) for state, action in zip(states, actions)]
+    import vec_env  # vec_envがengineを読み込むので、使うときに読み込む
+    env = vec_env.VecEnv(stage, len(states))
+    env.load(states)
+    env.step(actions)
+    return env.states()
+
+
+# 行動列を順に適用した最終状態
+def run(stage, actions, state=None):
+    if state is None:
+        state = initial_state(stage)
+    for action in actions:
+        state = step(stage, state, action)
+    return state
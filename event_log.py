@@ -0,0 +1,208 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+# ゲーム中の出来事の記録
+# 記録は (時刻, レベル, 種類, 値) のタプルのままメモリ上のリングバッファとキューに入れ、
+# 文字列への変換とファイルへの書き込みは別スレッドで行う（フレームの処理ではprintしない）
+# レベルが設定より低い記録は最初の比較だけで捨てる
+#
+# 環境変数での設定:
+#   SWAPWORLD_LOG          記録するレベル（debug, info, warning, error, off。既定はinfo）
+#   SWAPWORLD_LOG_FILE     書き出すファイル（JSON Lines。既定は logs/events.jsonl、空にすると書き出さない）
+#   SWAPWORLD_LOG_MAX_BYTES  ファイルの大きさの上限（既定は4MiB、0なら上限なし）
+#                            上限を超えたら .1 を付けた名前に移して新しいファイルに書く（残すのは1つ前の分だけ）
+#   SWAPWORLD_LOG_CONSOLE  1なら標準出力にも表示する
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error", OFF: "off"}
+
+# 記録の種類
+MOVE_START = "move_start"
+MOVE = "move"
+BLOCKED = "blocked"
+SPECIAL = "special"
+FLIP = "flip"
+FLIP_DONE = "flip_done"
+STUCK = "stuck"
+CLEAR = "clear"
+UNDO = "undo"
+REDO = "redo"
+RECORD = "record"
+UNLOCK = "unlock"
+CRASH = "crash"
+RELOAD = "reload"
+RELOAD_ERROR = "reload_error"
+TRACE = "trace"
+HINT_ERROR = "hint_error"
+
+# 標準出力に表示するときの文
+MESSAGES = {
+    MOVE_START: "移動開始: ステージ {stage}, 世界 {world}, プレイヤー位置 {start} -> {end}",
+    MOVE: "移動完了: ステージ {stage}, 世界 {world}, プレイヤー位置 ({x}, {y})",
+    BLOCKED: "移動できません（{reason}）",
+    SPECIAL: "{cell}マスに到達しました！世界変化までの回数: {change_interval}",
+    FLIP: "世界が変化しました。ステージ {stage}, 世界 {world}",
+    FLIP_DONE: "世界の変化が完了しました。ステージ {stage}, 世界 {world}",
+    STUCK: "変化後、プレイヤーが壁に埋まってしまいました。移動が制限されます。",
+    CLEAR: "ゴールに到達しました！ステージ {stage}, {moves}手, {seconds:.2f}秒",
+    UNDO: "Undo: ステージ {stage}, 世界 {world}, プレイヤー位置 ({x}, {y})",
+    REDO: "Redo: ステージ {stage}, 世界 {world}, プレイヤー位置 ({x}, {y})",
+    RECORD: "ステージ {stage} の記録を更新しました。",
+    UNLOCK: "ステージ {stage} をクリアしました！次のステージが解放されました。",
+    CRASH: "エラーで終了しました: {error}",
+    RELOAD: "ステージ {stages} を再読み込みしました（{seconds:.4f}秒）",
+    RELOAD_ERROR: "世界ファイルを再読み込みできません: {error}",
+    TRACE: "{path} に {count} 件の計測結果を書き出しました。",
+    HINT_ERROR: "ステージ {stage} のヒントの表を作れません: {error}",
+}
+
+LOG_FILE = os.path.join("logs", "events.jsonl")
+LOG_MAX_BYTES = 4 << 20
+RING_SIZE = 1024
+
+
+def format_message(record):
+    timestamp, level, event, fields = record
+    try:
+        return MESSAGES[event].format(**fields)
+    except (KeyError, IndexError, ValueError):
+        return f"{event} {fields}"
+
+
+def record_to_json(record):
+    timestamp, level, event, fields = record
+    return json.dumps({"time": timestamp, "level": LEVEL_NAMES.get(level, level), "event": event, **fields}, ensure_ascii=False, default=str)
+
+
+class EventLog:
+    def __init__(self, level=INFO, path=None, console=False, ring_size=RING_SIZE, max_bytes=LOG_MAX_BYTES):
+        self.level = level
+        self.path = path
+        self.max_bytes = max_bytes
+        self.console = console
+        self.ring = deque(maxlen=ring_size)
+        self.queue = None
+        self.thread = None
+        if level < OFF and (path or console):
+            self.queue = queue.SimpleQueue()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    @property
+    def enabled(self):
+        return self.level < OFF
+
+    # 記録（フレームの処理から呼ぶ。変換と書き込みはしない）
+    def emit(self, level, event, **fields):
+        if level < self.level:
+            return
+        record = (time.time(), level, event, fields)
+        self.ring.append(record)
+        if self.queue is not None:
+            self.queue.put(record)
+
+    def open_file(self):
+        try:
+            log_dir = os.path.dirname(self.path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            return open(self.path, "a", encoding='utf-8')
+        except OSError as e:
+            print(f"{self.path} を開けません: {e}")
+            return None
+
+    # 上限を超えたファイルを .1 に移して新しく開き直す
+    def rotate(self, file):
+        file.close()
+        try:
+            os.replace(self.path, self.path + ".1")
+        except OSError as e:
+            print(f"{self.path} を移せません: {e}")
+        return self.open_file()
+
+    # 書き込みスレッド（たまっている記録をまとめて書く）
+    def run(self):
+        file = self.open_file() if self.path else None
+        while True:
+            records = [self.queue.get()]
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = records[-1] is None
+            records = [record for record in records if record is not None]
+            if file is not None:
+                if self.max_bytes:
+                    for record in records:
+                        if file is not None:
+                            file.write(record_to_json(record) + "\n")
+                            if file.tell() >= self.max_bytes:
+                                file = self.rotate(file)
+                else:
+                    file.write("".join(record_to_json(record) + "\n" for record in records))
+                if file is not None:
+                    file.flush()
+            if self.console:
+                for record in records:
+                    print(format_message(record))
+            if stop:
+                break
+        if file is not None:
+            file.close()
+
+    # リングバッファの内容（直近の記録）をファイルに書き出す
+    def dump(self, path):
+        dump_dir = os.path.dirname(path)
+        if dump_dir:
+            os.makedirs(dump_dir, exist_ok=True)
+        with open(path, "w", encoding='utf-8') as f:
+            for record in list(self.ring):
+                f.write(record_to_json(record) + "\n")
+        return path
+
+    # 書き込み待ちの記録を書き終えてからスレッドを止める
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=2)
+
+
+# 環境変数から作成
+def from_env(environ=os.environ):
+    level_name = environ.get("SWAPWORLD_LOG", "info").lower()
+    levels = {name: level for level, name in LEVEL_NAMES.items()}
+    level = levels.get(level_name, INFO)
+    path = environ.get("SWAPWORLD_LOG_FILE", LOG_FILE)
+    console = environ.get("SWAPWORLD_LOG_CONSOLE", "") not in ("", "0")
+    try:
+        max_bytes = max(int(environ.get("SWAPWORLD_LOG_MAX_BYTES", LOG_MAX_BYTES)), 0)
+    except ValueError:
+        print(f"SWAPWORLD_LOG_MAX_BYTES の値が正しくありません。{LOG_MAX_BYTES} を使います。")
+        max_bytes = LOG_MAX_BYTES
+    return EventLog(level, path or None, console, max_bytes=max_bytes)
+
+
+# 例外で終了したときに直近の記録をファイルに残す
+def install_crash_dump(log, folder="logs"):
+    previous_hook = sys.excepthook
+
+    def hook(exc_type, exc_value, traceback):
+        log.emit(ERROR, CRASH, error=f"{exc_type.__name__}: {exc_value}")
+        try:
+            path = log.dump(os.path.join(folder, time.strftime("crash-%Y%m%d-%H%M%S.jsonl")))
+            print(f"直近の記録を {path} に書き出しました。", file=sys.stderr)
+        except OSError:
+            pass
+        previous_hook(exc_type, exc_value, traceback)
+
+    sys.excepthook = hook
@@ -0,0 +1,46 @@
+import json
+import os
+
+import pygame
+
+# フォントのパスのキャッシュ
+# pygame.font.match_font はシステムのフォント一覧を調べるので遅い。見つけたパス（見つからなかったこと）をファイルに残す
+# フォントをインストールし直した場合はキャッシュファイルを消せば探し直す
+
+FONT_CACHE_FILE = os.path.join("cache", "fonts.json")
+
+
+def load_font_cache(cache_path=FONT_CACHE_FILE):
+    try:
+        with open(cache_path, "r", encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_font_cache(cache, cache_path=FONT_CACHE_FILE):
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w", encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=4)
+    os.replace(temp_path, cache_path)
+
+
+# フォント名からフォントファイルのパスを求める（見つからない場合はNone）
+def find_font(name, cache_path=FONT_CACHE_FILE):
+    cache = load_font_cache(cache_path)
+    if name in cache:
+        path = cache[name]
+        # 記録したファイルが消えていたら探し直す
+        if path is None or os.path.exists(path):
+            return path
+    path = pygame.font.match_font(name)
+    cache[name] = path
+    try:
+        save_font_cache(cache, cache_path)
+    except OSError:
+        pass
+    return path
@@ -0,0 +1,41 @@
+import time
+
+import pygame
+
+
+# フレームの待ち時間を管理する（単調増加する時計を使う）
+# アニメーション中は固定フレームレート、それ以外はイベントが来るまでブロックする
+class FrameScheduler:
+    def __init__(self, fps=60):
+        self.frame_time = 1.0 / fps
+        self.now = time.monotonic()
+        self.next_time = self.now
+
+    # フレームの開始（前のフレームからの経過秒数を返す）
+    def begin_frame(self):
+        now = time.monotonic()
+        dt = now - self.now
+        self.now = now
+        return dt
+
+    # 固定フレームレートで次のフレームまで待つ
+    def wait_frame(self):
+        self.next_time += self.frame_time
+        now = time.monotonic()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        else:
+            # 遅れた分は取り戻さない
+            self.next_time = now
+        return pygame.event.get()
+
+    # イベントが来るまで待つ（timeout秒で打ち切る、Noneなら無制限）
+    def wait_events(self, timeout=None):
+        if timeout is None:
+            event = pygame.event.wait()
+        else:
+            event = pygame.event.wait(max(int(timeout * 1000), 1))
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get())
+        self.next_time = time.monotonic()
+        return events
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import engine
+import solver
+from levels import CELL_CHARS, FLOOR, WALL, START, GOAL, PLUS, MINUS, StageLoadError, make_stage
+
+# ステージの自動生成
+# ランダムな迷路を作り、ソルバーでクリアできるものだけを残す
+# 難しさは最短手数と、ランダムに動いたときに壁に埋まる割合から求め、指定した範囲のものだけを書き出す
+
+# 生成の設定（密度は各マスがその種類になる確率）
+GeneratorConfig = namedtuple("GeneratorConfig", [
+    "width", "height", "worlds", "interval_min", "interval_max",
+    "wall_density", "plus_density", "minus_density", "playouts",
+])
+
+# 生成したステージ（rowsは世界ごとの迷路の行）
+GeneratedStage = namedtuple("GeneratedStage", ["seed", "intervals", "rows", "length", "stuck_rate", "difficulty"])
+
+
+# 難しさ（最短手数を、ランダムに動くと埋まりやすいほど重くする）
+def difficulty_score(length, stuck_rate):
+    return length * (1 + 2 * stuck_rate)
+
+
+def random_grid(config, rng):
+    floor_density = 1 - config.wall_density - config.plus_density - config.minus_density
+    grid = rng.choice(
+        np.array([FLOOR, WALL, PLUS, MINUS], dtype=np.uint8),
+        size=(config.worlds, config.height, config.width),
+        p=[floor_density, config.wall_density, config.plus_density, config.minus_density],
+    )
+    # スタートは1つ目の世界、ゴールはどれかの世界に置く
+    start_y, start_x = divmod(int(rng.integers(config.width * config.height)), config.width)
+    grid[0, start_y, start_x] = START
+    while True:
+        goal_world = int(rng.integers(config.worlds))
+        goal_y, goal_x = divmod(int(rng.integers(config.width * config.height)), config.width)
+        if (goal_world, goal_y, goal_x) != (0, start_y, start_x):
+            break
+    grid[goal_world, goal_y, goal_x] = GOAL
+    return grid
+
+
+# ランダムに動いたとき（動ける方向から等確率で選ぶ）に壁に埋まる割合
+def stuck_rate(stage, playouts, moves, rng):
+    start = engine.initial_state(stage)
+    stuck = 0
+    for _ in range(playouts):
+        state = start
+        for _ in range(moves):
+            actions = [action for action in range(4) if engine.check_move(stage, state, action) == engine.MOVE_OK]
+            if not actions:
+                break
+            state = engine.apply_move(stage, state, actions[int(rng.integers(len(actions)))])
+            if state.game_clear or state.is_stuck:
+                break
+        stuck += state.is_stuck
+    return stuck / playouts
+
+
+# 1つのステージの生成と評価（クリアできない場合はNone。プロセスプールから呼ばれる）
+def generate_stage(task):
+    config, seed = task
+    rng = np.random.default_rng(seed)
+    intervals = [int(rng.integers(config.interval_min, config.interval_max + 1)) for _ in range(config.worlds)]
+    grid = random_grid(config, rng)
+    # 2番目以降のステージとして扱う（スタート位置に戻れない方が条件が厳しい）
+    stage = make_stage("generated", grid, intervals, 1)
+    actions = solver.solve(stage)
+    if actions is None:
+        return None
+    rate = stuck_rate(stage, config.playouts, len(actions) * 4, rng)
+    rows = [["".join(CELL_CHARS[cell] for cell in row) for row in maze] for maze in grid.tolist()]
+    return GeneratedStage(seed, intervals, rows, len(actions), rate, difficulty_score(len(actions), rate))
+
+
+# 難しさが範囲内のステージをcount個生成する（batch_size個ずつ並列に作る）
+def generate(config, count, min_difficulty=0, max_difficulty=float("inf"), seed=0, jobs=None, batch_size=256, max_attempts=100000):
+    jobs = jobs or os.cpu_count() or 1
+    accepted = []
+    attempts = 0
+    solvable = 0
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        while len(accepted) < count and attempts < max_attempts:
+            tasks = [(config, (seed, attempts + k)) for k in range(min(batch_size, max_attempts - attempts))]
+            attempts += len(tasks)
+            if executor is None:
+                results = map(generate_stage, tasks)
+            else:
+                results = executor.map(generate_stage, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+            for result in results:
+                if result is None:
+                    continue
+                solvable += 1
+                if min_difficulty <= result.difficulty <= max_difficulty and len(accepted) < count:
+                    accepted.append(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return accepted, attempts, solvable
+
+
+# 次のステージ番号（既存の StageN の最大値+1）
+def next_stage_number(worlds_folder):
+    numbers = [0]
+    if os.path.isdir(worlds_folder):
+        for name in os.listdir(worlds_folder):
+            match = re.fullmatch(r"Stage(\d+)", name)
+            if match:
+                numbers.append(int(match.group(1)))
+    return max(numbers) + 1
+
+
+# Worlds/StageN/worldK.txt として書き出す
+def write_stage(worlds_folder, stage_name, generated):
+    stage_path = os.path.join(worlds_folder, stage_name)
+    os.makedirs(stage_path)
+    for world, (change_interval, rows) in enumerate(zip(generated.intervals, generated.rows)):
+        with open(os.path.join(stage_path, f"world{world + 1}.txt"), "w", encoding='utf-8') as f:
+            f.write(f"{change_interval}\n" + "\n".join(rows) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="クリアできるステージを自動生成する")
+    parser.add_argument("-n", "--count", type=int, default=10, help="生成するステージ数")
+    parser.add_argument("--worlds-folder", default="Worlds")
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--height", type=int, default=10)
+    parser.add_argument("--worlds", type=int, default=3, help="1ステージの世界数")
+    parser.add_argument("--interval-min", type=int, default=2)
+    parser.add_argument("--interval-max", type=int, default=5)
+    parser.add_argument("--wall-density", type=float, default=0.3)
+    parser.add_argument("--plus-density", type=float, default=0.03)
+    parser.add_argument("--minus-density", type=float, default=0.03)
+    parser.add_argument("--playouts", type=int, default=32, help="埋まる割合を調べるランダムな試行の回数")
+    parser.add_argument("--min-difficulty", type=float, default=0)
+    parser.add_argument("--max-difficulty", type=float, default=float("inf"))
+    parser.add_argument("-j", "--jobs", type=int, help="並列に動かすプロセス数（既定はCPUの数）")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--max-attempts", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true", help="ファイルを書き出さない")
+    parser.add_argument("-o", "--output", help="生成結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    if args.wall_density + args.plus_density + args.minus_density > 1:
+        print("壁、+マス、-マスの密度の合計は1以下でなければなりません。")
+        sys.exit(2)
+    if args.interval_min < 1 or args.interval_max < args.interval_min:
+        print("変化までの回数の範囲が正しくありません。")
+        sys.exit(2)
+    config = GeneratorConfig(args.width, args.height, args.worlds, args.interval_min, args.interval_max,
+                             args.wall_density, args.plus_density, args.minus_density, args.playouts)
+
+    start_time = time.perf_counter()
+    try:
+        accepted, attempts, solvable = generate(config, args.count, args.min_difficulty, args.max_difficulty,
+                                                args.seed, args.jobs, args.batch_size, args.max_attempts)
+    except StageLoadError as e:
+        print(e)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+
+    number = next_stage_number(args.worlds_folder)
+    report = []
+    for generated in accepted:
+        stage_name = f"Stage{number}"
+        number += 1
+        if not args.dry_run:
+            write_stage(args.worlds_folder, stage_name, generated)
+        report.append({
+            "stage": stage_name,
+            "seed": list(generated.seed),
+            "intervals": generated.intervals,
+            "length": generated.length,
+            "stuck_rate": generated.stuck_rate,
+            "difficulty": generated.difficulty,
+        })
+        print(f"{stage_name}: {generated.length}手, 埋まる割合 {generated.stuck_rate:.2f}, 難しさ {generated.difficulty:.1f}")
+    print(f"{attempts}個中 {solvable}個がクリア可能、{len(accepted)}個を採用しました（{elapsed:.2f}秒）。")
+
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    if len(accepted) < args.count:
+        sys.exit(1)
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import engine
+import event_log
+from levels import WALL, START, GOAL, PLUS, MINUS
+
+# ヒント（ゴールまでの残り手数と最善の次の一手）
+# solverと同じ状態 (stage.cells上の位置, 残り手数r) について、ゴールからの逆向きの幅優先探索で全状態の手数を求めて表にする
+# 表は int32 で 手数*4 + 最善の行動（ゴールに行けない状態は-1）
+# ステージの内容のハッシュをキーにして cache/hints/ に保存し、次回からはメモリマップで読む
+# キャッシュの合計が HINT_CACHE_LIMIT を超えたら、最後に使ってから長いものから消す（使うたびに更新日時を新しくする）
+# ゲームからはHintLoaderで別スレッドで読み込み、準備ができるまでは「準備中」と表示する
+
+HINT_CACHE_DIR = os.path.join("cache", "hints")
+UNREACHABLE = -1
+MAX_STATES = 1 << 24  # これより状態の多いステージではヒントを使わない（表は状態数×4バイト）
+HINT_CACHE_LIMIT = 256 << 20  # キャッシュの合計の上限（バイト）
+
+
+# ステージの内容（迷路、変化までの回数、スタートに戻れるか）のハッシュ
+def stage_hash(stage):
+    digest = hashlib.sha256()
+    digest.update(repr((stage.grid.shape, stage.intervals, stage.sizes, stage.lock_start)).encode('utf-8'))
+    digest.update(stage.cells)
+    return digest.hexdigest()[:32]
+
+
+def r_size(stage):
+    return max(max(stage.intervals), 0) + 1
+
+
+def state_count(stage):
+    return len(stage.cells) * r_size(stage)
+
+
+# 表の作成（ゴールからの逆向きの幅優先探索）
+# 前の状態は手数ごとの最前線から直接求めるので、全状態の行き先の表は作らない（使うメモリは表と最前線の分だけ）
+# stopにthreading.Eventを渡すと、セットされたときに途中でやめてNoneを返す
+def build_table(stage, stop=None):
+    worlds, height, width = stage.grid.shape
+    world_size = width * height
+    size = r_size(stage)
+    state_total = len(stage.cells) * size
+    index_type = np.int32 if state_total < 2 ** 31 else np.int64
+    cells = np.frombuffer(stage.cells, dtype=np.uint8)
+    intervals = np.maximum(np.array(stage.intervals, dtype=index_type), 0)
+    weights = np.ones(256, dtype=index_type)
+    weights[PLUS] = 0
+    weights[MINUS] = 2
+    # ゴール以外で移動先にできるマス（ゴールへの移動は別に扱う）
+    enterable = (cells != WALL) & (cells != GOAL)
+    if stage.lock_start:
+        enterable &= cells != START
+    table = np.full(state_total, UNREACHABLE, dtype=np.int32)
+
+    # 移動先の位置と移動前の残り手数から、(移動前の状態, 行動) を行動ごとに作る
+    def sources(targets, rs, found_states, found_actions):
+        x = targets % width
+        y = targets // width % height
+        for action, (dx, dy) in enumerate(engine.DIRECTIONS):
+            valid = (x - dx >= 0) & (x - dx < width) & (y - dy >= 0) & (y - dy < height)
+            found_states.append((targets[valid] - dy * width - dx) * size + rs[valid])
+            found_actions.append(np.full(int(valid.sum()), action, dtype=np.int8))
+
+    # ゴールの隣からは、どの残り手数でも1手でクリアできる
+    goals = np.flatnonzero(cells == GOAL).astype(index_type)
+    frontier = None
+    distance = 0
+    while True:
+        if stop is not None and stop.is_set():
+            return None
+        found_states = []
+        found_actions = []
+        if frontier is None:
+            sources(np.repeat(goals, size), np.tile(np.arange(size, dtype=index_type), len(goals)), found_states, found_actions)
+        else:
+            position = frontier // size
+            r = frontier % size
+            # 世界が変化しない移動（移動後の残り手数は r = 移動前 - 重み > 0）
+            weight = weights[cells[position]]
+            valid = enterable[position] & (r > 0) & (r + weight < size)
+            sources(position[valid], (r + weight)[valid], found_states, found_actions)
+            # 世界が変化する移動（前の世界の同じ位置に入り、移動前の残り手数が重み以下）
+            world = position // world_size
+            previous = (world + worlds - 1) % worlds * world_size + position % world_size
+            valid = (r == intervals[world]) & (cells[position] != WALL) & enterable[previous]
+            previous = previous[valid]
+            weight = weights[cells[previous]]
+            for previous_r in range(min(3, size)):
+                valid = previous_r <= weight
+                sources(previous[valid], np.full(int(valid.sum()), previous_r, dtype=index_type), found_states, found_actions)
+        states = np.concatenate(found_states)
+        actions = np.concatenate(found_actions)
+        new = table[states] == UNREACHABLE
+        states, first = np.unique(states[new], return_index=True)
+        if len(states) == 0:
+            break
+        distance += 1
+        table[states] = distance * 4 + actions[new][first].astype(np.int32)
+        frontier = states
+    return table
+
+
+class HintTable:
+    def __init__(self, stage, table):
+        self.stage = stage
+        self.table = table
+        self.r_size = r_size(stage)
+
+    # 状態の番号（solverと同じ並び）
+    def state_index(self, state):
+        stage = self.stage
+        r = min(max(state.change_interval - state.move_count, 0), self.r_size - 1)
+        return ((state.world * stage.height + state.y) * stage.width + state.x) * self.r_size + r
+
+    # (最善の行動, ゴールまでの手数)。ゴールに行けない場合はNone
+    def lookup(self, state):
+        if state.game_clear or state.is_stuck:
+            return None
+        value = int(self.table[self.state_index(state)])
+        if value == UNREACHABLE:
+            return None
+        return value & 3, value >> 2
+
+
+# 表の読み込み（なければ作ってキャッシュする。stopで途中でやめた場合はNone）
+def load_table(stage, cache_dir=HINT_CACHE_DIR, stop=None):
+    path = os.path.join(cache_dir, f"{stage_hash(stage)}.npy")
+    try:
+        table = np.load(path, mmap_mode='r')
+        if table.shape == (state_count(stage),):
+            touch(path)
+            return HintTable(stage, table)
+    except (OSError, ValueError):
+        pass
+    table = build_table(stage, stop)
+    if table is None:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, table)
+        os.replace(temp_path, path)
+        prune_cache(cache_dir, path)
+    except OSError:
+        pass
+    return HintTable(stage, table)
+
+
+# 最後に使った時刻として更新日時を新しくする（書き込めない場合はそのまま）
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# 合計がlimitに収まるまで、最後に使ってから長い表を消す（keep_pathは消さない）
+# 他のプロセスが使っていて消せない表（Windows）はそのままにする
+def prune_cache(cache_dir, keep_path, limit=HINT_CACHE_LIMIT):
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npy"):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime_ns, st.st_size, entry.path))
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= limit:
+            break
+        if os.path.normpath(path) == os.path.normpath(keep_path):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+# 表を別のスレッドで読み込む（大きなステージでも画面を止めない）
+# 状態が多すぎるステージではenabledがFalseになり、表は作らない
+# 読み込みに失敗した場合はerrorに理由が入る（logを渡すとevent_logにも記録する）
+class HintLoader:
+    def __init__(self, stage, cache_dir=HINT_CACHE_DIR, log=None):
+        self.stage = stage
+        self.table = None
+        self.error = None
+        self.log = log
+        self.enabled = state_count(stage) <= MAX_STATES
+        self.stop = threading.Event()
+        if self.enabled:
+            threading.Thread(target=self.run, args=(cache_dir,), daemon=True).start()
+
+    def run(self, cache_dir):
+        try:
+            self.table = load_table(self.stage, cache_dir, self.stop)
+        except MemoryError:
+            self.enabled = False
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            if self.log is not None:
+                self.log.emit(event_log.ERROR, event_log.HINT_ERROR, stage=self.stage.name, error=self.error)
+
+    # 読み込み中の表が要らなくなったとき
+    def cancel(self):
+        self.stop.set()
+
+
+# 次の世界の変化で壁に埋まってしまう行動
+def stuck_moves(stage, state):
+    return [
+        action for action in range(4)
+        if engine.check_move(stage, state, action) == engine.MOVE_OK and engine.apply_move(stage, state, action).is_stuck
+    ]
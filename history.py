@@ -0,0 +1,96 @@
+from array import array
+
+import engine
+
+# Undo/Redoの履歴
+# 1手ごとに行動を1バイトで記録し、keyframe_interval手ごとに状態そのもの（キーフレーム）を記録する
+# 任意の手番号の状態は直前のキーフレームから最大 keyframe_interval-1 手を再計算して求める
+# 記録がmax_movesを超えたら古い手から捨てるので、長時間遊んでもメモリは一定
+
+MAX_MOVES = 100000
+KEYFRAME_INTERVAL = 32
+STATE_FIELDS = 6
+
+
+def pack_state(state):
+    flags = int(state.is_stuck) | int(state.game_clear) << 1
+    return (state.x, state.y, state.world, state.move_count, state.change_interval, flags)
+
+
+def unpack_state(values):
+    x, y, world, move_count, change_interval, flags = values
+    return engine.State(x, y, world, move_count, change_interval, bool(flags & 1), bool(flags & 2))
+
+
+class History:
+    def __init__(self, stage, state, max_moves=MAX_MOVES, keyframe_interval=KEYFRAME_INTERVAL):
+        self.stage = stage
+        self.max_moves = max_moves
+        self.keyframe_interval = keyframe_interval
+        self.base = 0  # 記録に残っている最初の手番号
+        self.position = 0  # 現在の手番号
+        self.state = state
+        self.actions = bytearray()
+        self.keyframes = array('i', pack_state(state))
+
+    # 記録に残っている最後の手番号
+    @property
+    def end(self):
+        return self.base + len(self.actions)
+
+    # 1手進んだことを記録する（取り消した手は捨てる）
+    def push(self, action, state):
+        interval = self.keyframe_interval
+        offset = self.position - self.base
+        if offset < len(self.actions):
+            del self.actions[offset:]
+            del self.keyframes[(offset // interval + 1) * STATE_FIELDS:]
+        self.actions.append(action)
+        self.position += 1
+        self.state = state
+        if (offset + 1) % interval == 0:
+            self.keyframes.extend(pack_state(state))
+        # 上限を超えたら古い手をキーフレーム1つ分まとめて捨てる
+        if len(self.actions) > self.max_moves + interval:
+            del self.actions[:interval]
+            del self.keyframes[:STATE_FIELDS]
+            self.base += interval
+
+    def can_undo(self):
+        return self.position > self.base
+
+    def can_redo(self):
+        return self.position < self.end
+
+    # 1手戻す（戻せない場合はNone）
+    def undo(self):
+        if not self.can_undo():
+            return None
+        self.position -= 1
+        self.state = self.state_at(self.position)
+        return self.state
+
+    # 1手やり直す（やり直せない場合はNone）
+    def redo(self):
+        if not self.can_redo():
+            return None
+        action = self.actions[self.position - self.base]
+        self.state = engine.apply_move(self.stage, self.state, action)
+        self.position += 1
+        return self.state
+
+    # 指定した手番号の状態に移動する（記録の範囲外は端に丸める）
+    def jump(self, index):
+        self.position = min(max(index, self.base), self.end)
+        self.state = self.state_at(self.position)
+        return self.state
+
+    # 指定した手番号の状態（現在位置は変えない）
+    def state_at(self, index):
+        interval = self.keyframe_interval
+        offset = min(max(index - self.base, 0), len(self.actions))
+        keyframe = offset // interval
+        state = unpack_state(self.keyframes[keyframe * STATE_FIELDS:(keyframe + 1) * STATE_FIELDS])
+        for action in self.actions[keyframe * interval:offset]:
+            state = engine.apply_move(self.stage, state, action)
+        return state
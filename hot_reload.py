@@ -0,0 +1,235 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from level_pack import check_world, compile_pack
+from levels import WALL, StageLoadError, assemble_stage, natural_key, parse_maze, read_world
+
+# 世界ファイルの変更の監視と、変更されたファイルだけの再読み込み
+# Linuxではinotify、それ以外（またはinotifyが使えない場合）は更新日時のポーリングで変更を検出する
+# 監視は別スレッドで行い、変更があればon_changeを呼ぶ（メインループにはpygameのイベントで知らせる）
+
+POLL_INTERVAL = 0.5  # ポーリングの間隔（秒）
+SETTLE_TIME = 0.05   # 保存が終わるまで待つ時間（エディタは1回の保存で何度も書き込むことがある）
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def is_world_file(name):
+    return name.startswith('world') and name.endswith('.txt')
+
+
+class WorldWatcher:
+    def __init__(self, worlds_folder, on_change, use_inotify=True):
+        self.worlds_folder = worlds_folder
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.closed = False
+        self.inotify = None
+        self.watches = {}
+        if use_inotify and sys.platform.startswith("linux"):
+            self.inotify = self.open_inotify()
+        self.method = "inotify" if self.inotify is not None else "polling"
+        self.thread = threading.Thread(target=self.run_inotify if self.inotify is not None else self.run_polling, daemon=True)
+        self.thread.start()
+
+    # 変更されたパスの集合を受け取る（受け取った分は消える）
+    def take_changes(self):
+        with self.lock:
+            changed = self.changed
+            self.changed = set()
+        return changed
+
+    def notify(self, paths):
+        if not paths:
+            return
+        with self.lock:
+            self.changed |= paths
+        self.on_change()
+
+    def open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        self.libc = libc
+        self.fd = fd
+        self.add_watch(self.worlds_folder)
+        for name in os.listdir(self.worlds_folder):
+            path = os.path.join(self.worlds_folder, name)
+            if os.path.isdir(path):
+                self.add_watch(path)
+        return fd
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def run_inotify(self):
+        while not self.closed:
+            readable, _, _ = select.select([self.fd], [], [], 1.0)
+            if not readable:
+                continue
+            time.sleep(SETTLE_TIME)
+            paths = set()
+            while True:
+                try:
+                    data = os.read(self.fd, 65536)
+                except BlockingIOError:
+                    break
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0").decode('utf-8', 'replace')
+                    offset += INOTIFY_EVENT.size + length
+                    folder = self.watches.get(wd)
+                    if folder is None or not name:
+                        continue
+                    path = os.path.join(folder, name)
+                    if folder == self.worlds_folder:
+                        # ステージのフォルダの追加や削除
+                        if mask & IN_ISDIR:
+                            if mask & (IN_CREATE | IN_MOVED_TO):
+                                self.add_watch(path)
+                            paths.add(path)
+                    elif is_world_file(name):
+                        paths.add(path)
+            self.notify(paths)
+        os.close(self.fd)
+
+    # 世界ファイルの (更新日時, サイズ)
+    def snapshot(self):
+        files = {}
+        try:
+            stage_names = os.listdir(self.worlds_folder)
+        except OSError:
+            return files
+        for stage_name in stage_names:
+            stage_path = os.path.join(self.worlds_folder, stage_name)
+            if not os.path.isdir(stage_path):
+                continue
+            try:
+                names = os.listdir(stage_path)
+            except OSError:
+                # 一覧を取った後に消されたフォルダ
+                continue
+            files[stage_path] = None
+            for name in names:
+                if is_world_file(name):
+                    path = os.path.join(stage_path, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def run_polling(self):
+        previous = self.snapshot()
+        while not self.closed:
+            time.sleep(POLL_INTERVAL)
+            current = self.snapshot()
+            paths = {path for path in previous.keys() | current.keys() if previous.get(path, -1) != current.get(path, -1)}
+            previous = current
+            self.notify(paths)
+
+    def close(self):
+        self.closed = True
+
+
+# ステージの追加や削除のときに、別スレッドでパックを作り直す
+# 作り直したパックはpack_pathに書き出し（使用中のパックには触らない）、終わったらon_doneを呼ぶ
+class PackBuilder:
+    def __init__(self, worlds_folder, pack_path, on_done):
+        self.worlds_folder = worlds_folder
+        self.pack_path = pack_path
+        self.on_done = on_done
+        self.error = None
+        self.done = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            compile_pack(self.worlds_folder, self.pack_path)
+        except (StageLoadError, OSError, UnicodeDecodeError) as e:
+            self.error = e
+        self.done = True
+        self.on_done()
+
+
+# 変更されたファイルのステージだけを作り直してpackに差し替える
+# 戻り値は (作り直したステージ番号の一覧, エラーの一覧)。ステージの追加や削除があった場合は一覧の代わりにNone
+def reload_stages(pack, worlds_folder, paths):
+    changed_by_stage = {}
+    for path in paths:
+        relative = os.path.relpath(path, worlds_folder)
+        stage_name = relative.split(os.sep)[0]
+        changed_by_stage.setdefault(stage_name, set()).add(os.path.normpath(path))
+
+    reloaded = []
+    errors = []
+    for stage_name, changed in sorted(changed_by_stage.items()):
+        stage_path = os.path.join(worlds_folder, stage_name)
+        if stage_name not in pack.names or not os.path.isdir(stage_path):
+            return None, errors
+        if os.path.normpath(stage_path) in changed:
+            return None, errors
+        index = pack.names.index(stage_name)
+        old = pack[index]
+        mazes = []
+        intervals = []
+        try:
+            world_paths = [os.path.join(stage_path, f) for f in sorted(os.listdir(stage_path), key=natural_key) if is_world_file(f)]
+            same_worlds = len(world_paths) == len(old.intervals)
+            for k, world_path in enumerate(world_paths):
+                if same_worlds and os.path.normpath(world_path) not in changed:
+                    # 変更されていない世界は読み込み済みの迷路を使う
+                    width, height = old.sizes[k]
+                    mazes.append(old.grid[k, :height, :width])
+                    intervals.append(old.intervals[k])
+                else:
+                    change_interval, rows = read_world(world_path)
+                    check_world(world_path, change_interval, rows)
+                    mazes.append(parse_maze(rows))
+                    intervals.append(change_interval)
+        except (StageLoadError, OSError, UnicodeDecodeError) as e:
+            # 保存の途中などで読めない場合は前のステージのままにする
+            errors.append(f"{stage_name}: {e}")
+            continue
+        if not mazes:
+            errors.append(f"{stage_name}: 世界ファイルがありません。")
+            continue
+        pack.replace_stage(index, assemble_stage(stage_name, mazes, intervals, index))
+        reloaded.append(index)
+    return reloaded, errors
+
+
+# 再読み込み後もプレイヤーの状態が使えるか（使えない場合はNone）
+def keep_state(stage, state):
+    if state.world >= len(stage.intervals):
+        return None
+    width, height = stage.sizes[state.world]
+    if not (0 <= state.x < width and 0 <= state.y < height):
+        return None
+    on_wall = stage.grid[state.world, state.y, state.x] == WALL
+    if on_wall and not state.is_stuck:
+        return None
+    return state._replace(is_stuck=bool(on_wall))
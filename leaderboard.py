@@ -0,0 +1,446 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import engine
+import hints
+from level_pack import LevelPack, open_pack
+from levels import StageLoadError
+from solver import ACTION_KEYS
+from vec_env import VecEnv
+
+# ステージごとの最短手数のランキング（ローカルのサーバー）
+# 1行1つのJSON（JSON Lines）をTCPで受け取り、1行1つのJSONで答える。応答は要求の"id"を付けて、終わった順に返す
+#   {"id": 1, "player": "名前", "stage": "Stage1", "moves": "ssdd..."}  提出（手はWASDの文字列）
+#   {"id": 2, "top": "Stage1", "limit": 10}                              ランキングの取得
+# 提出は少しの間ためてからまとめてワーカープロセスに渡し、VecEnvでゲームのルールどおりに再生して確かめる
+# ワーカーはステージパックを1回だけ開き、展開したステージを使い回す
+# 受理した記録は索引付きのSQLiteに保存する（ステージの内容のハッシュごとに、プレイヤーの最短手数だけを残す）
+
+HOST = "127.0.0.1"
+PORT = 8765
+DB_FILE = os.path.join("cache", "leaderboard.sqlite3")
+MAX_MOVES = 100000     # 受け付ける最大の手数
+MAX_PLAYER = 64        # プレイヤー名の最大の長さ
+BATCH_SIZE = 1024      # 1回にワーカーに渡す提出の数
+BATCH_DELAY = 0.005    # 提出をためる時間（秒）
+CHUNK_SIZE = 256       # VecEnvで同時に再生する数（手数の近いものをまとめる）
+TOP_LIMIT = 100
+
+# 文字から行動への表（知らない文字は-1）
+KEY_ACTIONS = np.full(256, -1, dtype=np.int8)
+for action, key in enumerate(ACTION_KEYS):
+    KEY_ACTIONS[ord(key.lower())] = action
+    KEY_ACTIONS[ord(key.upper())] = action
+
+# 不合格の理由
+BLOCKED_REASONS = {
+    engine.BLOCKED_CLEAR: "after_clear",
+    engine.BLOCKED_STUCK: "stuck",
+    engine.BLOCKED_BOUNDS: "bounds",
+    engine.BLOCKED_WALL: "wall",
+    engine.BLOCKED_START: "start",
+}
+
+
+# ワーカープロセスの状態（ステージパックとステージのハッシュ）
+worker_pack = None
+worker_hashes = {}
+
+
+def init_worker(pack_path):
+    global worker_pack
+    worker_pack = LevelPack(pack_path)
+
+
+def stage_hash(stage_index):
+    value = worker_hashes.get(stage_index)
+    if value is None:
+        value = hints.stage_hash(worker_pack[stage_index])
+        worker_hashes[stage_index] = value
+    return value
+
+
+# 提出をまとめて確かめる（ワーカープロセスで実行）
+# submissions: (ステージ番号, 手の文字列のbytes) のリスト
+# 戻り値: 提出ごとの (ステージのハッシュ, 不合格の理由（合格ならNone）, 問題のあった手の番号)
+def verify_batch(submissions):
+    results = [None] * len(submissions)
+    groups = {}
+    for i, (stage_index, moves) in enumerate(submissions):
+        actions = KEY_ACTIONS[np.frombuffer(moves, dtype=np.uint8)]
+        invalid = np.flatnonzero(actions < 0)
+        if len(actions) == 0:
+            results[i] = (None, "empty", 0)
+        elif len(invalid):
+            results[i] = (None, "invalid_key", int(invalid[0]))
+        else:
+            groups.setdefault(stage_index, []).append((i, actions))
+
+    for stage_index, items in groups.items():
+        stage = worker_pack[stage_index]
+        if stage.start is None:
+            for i, actions in items:
+                results[i] = (None, "no_start", 0)
+            continue
+        digest = stage_hash(stage_index)
+        items.sort(key=lambda item: len(item[1]))
+        for begin in range(0, len(items), CHUNK_SIZE):
+            chunk = items[begin:begin + CHUNK_SIZE]
+            for (i, actions), (reason, index) in zip(chunk, verify_chunk(stage, [actions for i, actions in chunk])):
+                results[i] = (digest, reason, index)
+    return results
+
+
+# 同じステージの手の列をVecEnvでまとめて再生する
+# 全ての手が移動でき、最後の手でちょうどゴールに着いたものだけ合格
+def verify_chunk(stage, action_lists):
+    count = len(action_lists)
+    lengths = np.array([len(actions) for actions in action_lists])
+    steps = int(lengths.max())
+    # 短い列の後ろは何の手でもよい（その手の結果は見ない）
+    padded = np.zeros((steps, count), dtype=np.int8)
+    for j, actions in enumerate(action_lists):
+        padded[:len(actions), j] = actions
+    env = VecEnv(stage, count)
+    failed_at = np.full(count, -1, dtype=np.int64)
+    failed_result = np.zeros(count, dtype=np.int8)
+    cleared_at = np.full(count, -1, dtype=np.int64)
+    for t in range(steps):
+        observations, result, clear, stuck = env.step(padded[t])
+        active = t < lengths
+        failed = active & (result != engine.MOVE_OK) & (failed_at < 0)
+        failed_at[failed] = t
+        failed_result[failed] = result[failed]
+        cleared_at[active & clear] = t
+
+    verdicts = []
+    for j in range(count):
+        if failed_at[j] >= 0:
+            verdicts.append((BLOCKED_REASONS.get(int(failed_result[j]), "blocked"), int(failed_at[j])))
+        elif cleared_at[j] != lengths[j] - 1:
+            verdicts.append(("not_cleared", int(lengths[j])))
+        else:
+            verdicts.append((None, None))
+    return verdicts
+
+
+# 記録の保存先（SQLite。呼び出しは1つのスレッドからだけ行う）
+class ResultStore:
+    def __init__(self, path=DB_FILE):
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "stage_hash TEXT NOT NULL, stage TEXT NOT NULL, player TEXT NOT NULL, "
+            "moves INTEGER NOT NULL, actions TEXT NOT NULL, submitted REAL NOT NULL, "
+            "PRIMARY KEY (stage_hash, player))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_rank ON results (stage_hash, moves, submitted)")
+        self.db.commit()
+
+    # 受理した記録をまとめて保存する（同じプレイヤーは手数が減ったときだけ更新）
+    def add_many(self, rows):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO results (stage_hash, stage, player, moves, actions, submitted) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (stage_hash, player) DO UPDATE SET "
+                "moves = excluded.moves, actions = excluded.actions, submitted = excluded.submitted "
+                "WHERE excluded.moves < results.moves",
+                rows,
+            )
+
+    def top(self, stage_hash, limit):
+        cursor = self.db.execute(
+            "SELECT player, moves, submitted FROM results WHERE stage_hash = ? ORDER BY moves, submitted LIMIT ?",
+            (stage_hash, limit),
+        )
+        return [{"player": player, "moves": moves, "submitted": submitted} for player, moves, submitted in cursor]
+
+    def close(self):
+        self.db.close()
+
+
+class LeaderboardService:
+    def __init__(self, pack, store, jobs=None, batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY):
+        self.pack = pack
+        self.store = store
+        self.stage_indices = {name: index for index, name in enumerate(pack.names)}
+        self.stage_hashes = {}
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.jobs = jobs or os.cpu_count() or 1
+        self.pool = self.start_pool()
+        self.db_thread = ThreadPoolExecutor(max_workers=1)  # SQLiteの読み書きはこのスレッドだけで行う
+        self.pending = []
+        self.flush_handle = None
+        self.batch_tasks = set()  # 実行中のまとまり（途中で消されないように参照を持っておく）
+        self.submitted = 0
+        self.accepted = 0
+
+    # ワーカーはspawnで起動する（forkだと開いている接続のソケットを引き継いでしまい、接続が閉じなくなる）
+    def start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=init_worker, initargs=(self.pack.path,))
+
+    # 提出（確かめて、合格なら保存してから答える）
+    async def submit(self, player, stage_name, moves):
+        stage_index = self.stage_indices.get(stage_name)
+        if stage_index is None:
+            return {"ok": False, "error": "unknown_stage"}
+        if not isinstance(player, str) or not player:
+            return {"ok": False, "error": "no_player"}
+        if len(player) > MAX_PLAYER:
+            return {"ok": False, "error": "player_too_long"}
+        if not isinstance(moves, str) or len(moves) > MAX_MOVES:
+            return {"ok": False, "error": "too_long" if isinstance(moves, str) else "no_moves"}
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((stage_index, moves.encode('ascii', 'replace'), player, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self.flush)
+        return await future
+
+    # たまっている提出をワーカーに渡す
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch = self.pending
+        self.pending = []
+        if batch:
+            task = asyncio.create_task(self.run_batch(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            verdicts = await loop.run_in_executor(self.pool, verify_batch, [(stage_index, moves) for stage_index, moves, player, future in batch])
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # ワーカーが落ちたプールは二度と使えないので作り直す（このまとまりの提出は失敗として答える）
+                self.pool.shutdown(wait=False)
+                self.pool = self.start_pool()
+            self.fail_batch(batch, e)
+            return
+        now = time.time()
+        rows = []
+        responses = []
+        for (stage_index, moves, player, future), (digest, reason, index) in zip(batch, verdicts):
+            stage_name = self.pack.names[stage_index]
+            if reason is None:
+                self.stage_hashes[stage_name] = digest
+                rows.append((digest, stage_name, player, len(moves), moves.decode('ascii'), now))
+                responses.append({"ok": True, "stage": stage_name, "moves": len(moves)})
+            else:
+                responses.append({"ok": False, "stage": stage_name, "error": reason, "at": index})
+        self.submitted += len(batch)
+        self.accepted += len(rows)
+        if rows:
+            try:
+                await loop.run_in_executor(self.db_thread, self.store.add_many, rows)
+            except Exception as e:
+                self.fail_batch(batch, e)
+                return
+        for (stage_index, moves, player, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+    def fail_batch(self, batch, error):
+        for stage_index, moves, player, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def top(self, stage_name, limit):
+        stage_index = self.stage_indices.get(stage_name)
+        if stage_index is None:
+            return {"ok": False, "error": "unknown_stage"}
+        digest = self.stage_hashes.get(stage_name)
+        if digest is None:
+            digest = hints.stage_hash(self.pack[stage_index])
+            self.stage_hashes[stage_name] = digest
+        results = await asyncio.get_running_loop().run_in_executor(self.db_thread, self.store.top, digest, min(max(int(limit), 1), TOP_LIMIT))
+        return {"ok": True, "stage": stage_name, "results": results}
+
+    async def handle_request(self, request):
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "bad_request"}
+        if "top" in request:
+            return await self.top(request["top"], request.get("limit", 10))
+        if "moves" in request:
+            return await self.submit(request.get("player"), request.get("stage"), request["moves"])
+        return {"ok": False, "error": "bad_request"}
+
+    # 1行を読む（接続の終わりはb""）
+    # ストリームの上限より長い行は次の改行まで読み捨ててNoneを返す
+    @staticmethod
+    async def read_line(reader):
+        try:
+            return await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+        while True:
+            await reader.readexactly(consumed)
+            try:
+                await reader.readuntil(b"\n")
+                return None
+            except asyncio.IncompleteReadError:
+                return None
+            except asyncio.LimitOverrunError as e:
+                consumed = e.consumed
+
+    # 1つの接続（要求は並行して処理し、終わった順に答える）
+    async def handle_client(self, reader, writer):
+        tasks = set()
+
+        async def answer(line):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"ok": False, "error": "bad_json"}
+                request = None
+            else:
+                try:
+                    response = await self.handle_request(request)
+                except (ValueError, TypeError) as e:
+                    response = {"ok": False, "error": "bad_request", "detail": str(e)}
+                except Exception as e:
+                    # 想定外のエラーでも接続は切らずに答える（詳しい内容はサーバー側にだけ出す）
+                    print(f"要求の処理に失敗しました: {e!r}", file=sys.stderr)
+                    response = {"ok": False, "error": "internal"}
+            if isinstance(request, dict) and "id" in request:
+                response["id"] = request["id"]
+            writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
+
+        try:
+            while True:
+                line = await self.read_line(reader)
+                if line is None:
+                    writer.write(json.dumps({"ok": False, "error": "too_long"}).encode('utf-8') + b"\n")
+                    continue
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.pool.shutdown()
+        self.db_thread.submit(self.store.close).result()
+        self.db_thread.shutdown()
+
+
+async def serve(args):
+    pack = open_pack(args.worlds_folder)
+    service = LeaderboardService(pack, ResultStore(args.db), args.jobs)
+    server = await asyncio.start_server(service.handle_client, args.host, args.port, limit=MAX_MOVES + 4096)
+    print(f"{args.host}:{args.port} で待っています（ステージ {len(pack)}個、{service.jobs}プロセス）。")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+        print(f"提出 {service.submitted}件、合格 {service.accepted}件")
+
+
+# 負荷の確認（同じ手の列をcount人分まとめて送り、1秒あたりの処理数を表示する）
+async def bench(args):
+    reader, writer = await asyncio.open_connection(args.host, args.port, limit=MAX_MOVES + 4096)
+    start_time = time.perf_counter()
+    for i in range(args.count):
+        request = {"id": i, "player": f"{args.player}{i}", "stage": args.stage, "moves": args.moves}
+        writer.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b"\n")
+        if i % 1000 == 999:
+            await writer.drain()
+    await writer.drain()
+    errors = {}
+    for i in range(args.count):
+        response = json.loads(await reader.readline())
+        if not response["ok"]:
+            errors[response["error"]] = errors.get(response["error"], 0) + 1
+    seconds = time.perf_counter() - start_time
+    writer.close()
+    print(f"{args.count}件 {seconds:.2f}秒（{args.count / seconds:.0f}件/秒）、不合格: {errors or 'なし'}")
+
+
+async def request_once(args, request):
+    reader, writer = await asyncio.open_connection(args.host, args.port, limit=MAX_MOVES + 4096)
+    writer.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b"\n")
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    print(json.dumps(response, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ステージごとの最短手数のランキングサーバー")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="サーバーを起動する")
+    serve_parser.add_argument("worlds_folder", nargs="?", default="Worlds")
+    serve_parser.add_argument("-j", "--jobs", type=int, help="確認に使うプロセス数（既定はCPUの数）")
+    serve_parser.add_argument("--db", default=DB_FILE, help="記録を保存するSQLiteのファイル")
+
+    submit_parser = commands.add_parser("submit", help="手の列を提出する")
+    submit_parser.add_argument("player")
+    submit_parser.add_argument("stage")
+    submit_parser.add_argument("moves", help="WASDの文字列")
+
+    top_parser = commands.add_parser("top", help="ランキングを表示する")
+    top_parser.add_argument("stage")
+    top_parser.add_argument("-n", "--limit", type=int, default=10)
+
+    bench_parser = commands.add_parser("bench", help="同じ手の列を大量に提出して処理速度を測る")
+    bench_parser.add_argument("stage")
+    bench_parser.add_argument("moves", help="WASDの文字列")
+    bench_parser.add_argument("-n", "--count", type=int, default=10000)
+    bench_parser.add_argument("--player", default="bench")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "serve":
+            asyncio.run(serve(args))
+        elif args.command == "submit":
+            asyncio.run(request_once(args, {"player": args.player, "stage": args.stage, "moves": args.moves}))
+        elif args.command == "top":
+            asyncio.run(request_once(args, {"top": args.stage, "limit": args.limit}))
+        elif args.command == "bench":
+            asyncio.run(bench(args))
+    except StageLoadError as e:
+        print(e)
+        sys.exit(2)
+    except (ConnectionError, OSError) as e:
+        print(f"{args.host}:{args.port} に接続できません: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from levels import StageLoadError, build_stage, list_stage_files, make_stage, read_world
+
+# コンパイル済みステージパック
+# Worlds/ のテキストファイルが元データで、内容が変わったときだけ作り直す
+#
+# ファイル構成:
+#   ヘッダー      HEADER
+#   ステージ表    STAGE_ENTRY * ステージ数
+#   ステージ名    UTF-8を連結したもの
+#   ステージデータ 世界ごとの WORLD_ENTRY * 世界数 + 迷路 (uint8 * 世界数*H*W)
+PACK_FILE = os.path.join("cache", "levels.pack")
+PACK_MAGIC = b"SWPK"
+PACK_VERSION = 2
+
+# マジック、バージョン、ステージ数、元ファイルの内容のハッシュ、元ファイルのサイズと更新日時のハッシュ
+HEADER = struct.Struct("<4sHxxI32s32s")
+FINGERPRINT_OFFSET = HEADER.size - 32
+# ステージ名の位置と長さ、世界数、高さ、幅、データの位置
+STAGE_ENTRY = struct.Struct("<IHHHHQ")
+# change_interval、世界の幅と高さ
+WORLD_ENTRY = struct.Struct("<iHH")
+# パックに入れられる迷路の幅と高さ、世界数、ステージ名の長さの上限（STAGE_ENTRYとWORLD_ENTRYのuint16）
+MAX_SIZE = 0xFFFF
+# パックに入れられるchange_intervalの範囲（WORLD_ENTRYのint32）
+MIN_INTERVAL = -0x80000000
+MAX_INTERVAL = 0x7FFFFFFF
+
+
+# 世界がパックに入るかの確認（入らない場合はStageLoadError）
+def check_world(world_path, change_interval, rows):
+    if not MIN_INTERVAL <= change_interval <= MAX_INTERVAL:
+        raise StageLoadError(f"{world_path} の変化までの回数 {change_interval} は範囲外です（{MIN_INTERVAL}〜{MAX_INTERVAL}）。")
+    while rows and not rows[-1]:
+        rows = rows[:-1]
+    width = max((len(row) for row in rows), default=0)
+    if width > MAX_SIZE or len(rows) > MAX_SIZE:
+        raise StageLoadError(f"{world_path} の迷路が大きすぎます（{width}x{len(rows)}、上限 {MAX_SIZE}x{MAX_SIZE}）。")
+
+
+# 元ファイルのサイズと更新日時のハッシュ（ファイルを読まずに変更を検出する）
+def stat_fingerprint(stage_files):
+    digest = hashlib.sha256()
+    for stage_name, world_paths in stage_files:
+        for world_path in world_paths:
+            st = os.stat(world_path)
+            digest.update(f"{world_path}\0{st.st_size}\0{st.st_mtime_ns}\0".encode('utf-8'))
+    return digest.digest()
+
+
+# 元ファイルの内容のハッシュ
+def content_digest(stage_files):
+    digest = hashlib.sha256()
+    for stage_name, world_paths in stage_files:
+        for world_path in world_paths:
+            digest.update(f"{stage_name}/{os.path.basename(world_path)}\0".encode('utf-8'))
+            with open(world_path, "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+    return digest.digest()
+
+
+# Worlds/ からステージパックを作成
+def compile_pack(worlds_folder="Worlds", pack_path=PACK_FILE, stage_files=None):
+    if stage_files is None:
+        stage_files = list_stage_files(worlds_folder)
+    stages = []
+    for stage_index, (stage_name, world_paths) in enumerate(stage_files):
+        if len(world_paths) > MAX_SIZE or len(stage_name.encode('utf-8')) > MAX_SIZE:
+            raise StageLoadError(f"{stage_name} はステージパックに入りません（世界数かフォルダ名の長さが上限 {MAX_SIZE} を超えています）。")
+        worlds = []
+        for world_path in world_paths:
+            change_interval, rows = read_world(world_path)
+            check_world(world_path, change_interval, rows)
+            worlds.append((change_interval, rows))
+        stages.append(build_stage(stage_name, worlds, stage_index))
+
+    names = [stage.name.encode('utf-8') for stage in stages]
+    table_end = HEADER.size + STAGE_ENTRY.size * len(stages)
+    data_offset = table_end + sum(len(name) for name in names)
+    entries = []
+    name_offset = table_end
+    for stage, name in zip(stages, names):
+        worlds, height, width = stage.grid.shape
+        entries.append(STAGE_ENTRY.pack(name_offset, len(name), worlds, height, width, data_offset))
+        name_offset += len(name)
+        data_offset += WORLD_ENTRY.size * worlds + stage.grid.nbytes
+
+    header = HEADER.pack(PACK_MAGIC, PACK_VERSION, len(stages), content_digest(stage_files), stat_fingerprint(stage_files))
+    pack_dir = os.path.dirname(pack_path)
+    if pack_dir:
+        os.makedirs(pack_dir, exist_ok=True)
+    temp_path = pack_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.writelines(entries)
+        f.writelines(names)
+        for stage in stages:
+            for change_interval, (width, height) in zip(stage.intervals, stage.sizes):
+                f.write(WORLD_ENTRY.pack(change_interval, width, height))
+            f.write(stage.grid.tobytes())
+    os.replace(temp_path, pack_path)
+    return len(stages)
+
+
+# パックのヘッダー（読めない場合はNone）
+def read_header(pack_path):
+    try:
+        with open(pack_path, "rb") as f:
+            data = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, stage_count, digest, fingerprint = HEADER.unpack(data)
+    if magic != PACK_MAGIC or version != PACK_VERSION:
+        return None
+    return stage_count, digest, fingerprint
+
+
+# メモリマップしたステージパック
+# ステージ名だけ先に読み、迷路は選択されたときに展開する
+class LevelPack:
+    def __init__(self, pack_path=PACK_FILE):
+        self.path = pack_path
+        with open(pack_path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, stage_count, digest, fingerprint = HEADER.unpack_from(self.data, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.data.close()
+            raise StageLoadError(f"{pack_path} はステージパックではありません。")
+        self.digest = digest
+        self.names = []
+        for index in range(stage_count):
+            name_offset, name_length = STAGE_ENTRY.unpack_from(self.data, HEADER.size + STAGE_ENTRY.size * index)[:2]
+            self.names.append(self.data[name_offset:name_offset + name_length].decode('utf-8'))
+        self.stages = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        return self.load_stage(index)
+
+    # ステージの展開（一度展開したものは使い回す。負の番号は後ろから数える）
+    def load_stage(self, index):
+        if not -len(self.names) <= index < len(self.names):
+            raise IndexError(f"ステージ番号 {index} は範囲外です（ステージ数 {len(self.names)}）。")
+        if index < 0:
+            index += len(self.names)
+        stage = self.stages.get(index)
+        if stage is None:
+            entry = STAGE_ENTRY.unpack_from(self.data, HEADER.size + STAGE_ENTRY.size * index)
+            name_offset, name_length, worlds, height, width, data_offset = entry
+            world_entries = [WORLD_ENTRY.unpack_from(self.data, data_offset + WORLD_ENTRY.size * k) for k in range(worlds)]
+            intervals = [change_interval for change_interval, world_width, world_height in world_entries]
+            sizes = [(world_width, world_height) for change_interval, world_width, world_height in world_entries]
+            grid = np.frombuffer(self.data, np.uint8, worlds * height * width, data_offset + WORLD_ENTRY.size * worlds)
+            grid = grid.reshape(worlds, height, width).copy()
+            stage = make_stage(self.names[index], grid, intervals, index, sizes)
+            self.stages[index] = stage
+        return stage
+
+    # ステージの差し替え（実行中の再読み込み用。パックのファイルは変更しない）
+    def replace_stage(self, index, stage):
+        self.stages[index] = stage
+
+    def close(self):
+        self.data.close()
+
+    # 閉じたパックを開き直す（ファイルが変わっていなければ、展開済みや差し替えたステージも引き継ぐ）
+    def reopen(self):
+        pack = LevelPack(self.path)
+        if pack.digest == self.digest:
+            pack.stages.update(self.stages)
+        return pack
+
+
+# ステージパックを開く（元ファイルが変わっていれば作り直す）
+def open_pack(worlds_folder="Worlds", pack_path=PACK_FILE):
+    stage_files = list_stage_files(worlds_folder)
+    header = read_header(pack_path)
+    if header is not None:
+        stage_count, digest, fingerprint = header
+        if fingerprint == stat_fingerprint(stage_files):
+            return LevelPack(pack_path)
+        if digest == content_digest(stage_files):
+            # 内容は同じで更新日時だけ変わった場合はヘッダーを書き換える
+            with open(pack_path, "r+b") as f:
+                f.seek(FINGERPRINT_OFFSET)
+                f.write(stat_fingerprint(stage_files))
+            return LevelPack(pack_path)
+    compile_pack(worlds_folder, pack_path, stage_files)
+    return LevelPack(pack_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worlds/ のステージをステージパックにまとめる")
+    parser.add_argument("worlds_folder", nargs="?", default="Worlds")
+    parser.add_argument("-o", "--output", default=PACK_FILE)
+    args = parser.parse_args()
+    try:
+        count = compile_pack(args.worlds_folder, args.output)
+    except StageLoadError as e:
+        print(e)
+        sys.exit(1)
+    print(f"{args.output} に {count} ステージを書き出しました。")
@@ -0,0 +1,132 @@
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+
+# セルの種類
+FLOOR = 0
+WALL = 1
+START = 2
+GOAL = 3
+PLUS = 4
+MINUS = 5
+
+# 文字とセルの種類の対応（未定義の文字は床として扱う）
+CELL_CODES = {'0': FLOOR, '1': WALL, 'S': START, 'G': GOAL, '+': PLUS, '-': MINUS}
+CELL_CHARS = "01SG+-"
+# 文字コードからセルの種類への表（255より大きい文字は255として引く）
+CELL_TABLE = np.full(256, FLOOR, dtype=np.uint8)
+for cell_char, cell_code in CELL_CODES.items():
+    CELL_TABLE[ord(cell_char)] = cell_code
+
+# ステージ
+# grid: (世界数, H, W) のuint8配列、cells: gridと同じ並びのbytes（1マスずつ参照する用）
+# 世界ごとに大きさが違う場合、gridは一番大きい世界に合わせて壁で埋める
+# sizes: 世界ごとの (幅, 高さ)、walls: 世界ごとの壁マスク、goals: ゴールの (世界, y, x) の配列
+Stage = namedtuple("Stage", ["name", "grid", "cells", "intervals", "width", "height", "sizes", "start", "goals", "walls", "lock_start"])
+
+
+# ステージ読み込み時のエラー
+class StageLoadError(Exception):
+    pass
+
+
+# スタート位置の検索
+def find_start(maze):
+    ys, xs = np.nonzero(maze == START)
+    if len(ys) == 0:
+        return None
+    return int(xs[0]), int(ys[0])
+
+
+# 世界ファイルの読み込み（変化までの回数と迷路の行）
+def read_world(world_path):
+    with open(world_path, "r", encoding='utf-8') as wf:
+        lines = wf.readlines()
+    if not lines:
+        raise StageLoadError(f"{world_path} は空です。")
+    try:
+        change_interval = int(lines[0].strip())
+    except ValueError:
+        raise StageLoadError(f"{world_path} の一行目は整数でなければなりません。")
+    return change_interval, [line.strip() for line in lines[1:]]
+
+
+# 迷路の行をセルの種類の配列に変換（短い行は壁で埋める）
+def parse_maze(rows):
+    while rows and not rows[-1]:
+        rows = rows[:-1]
+    width = max((len(row) for row in rows), default=0)
+    maze = np.full((len(rows), width), WALL, dtype=np.uint8)
+    # 全部の行をつないで一度に表を引き、各行の先頭から詰めて書き込む
+    lengths = np.array([len(row) for row in rows], dtype=np.intp)
+    chars = np.frombuffer("".join(rows).encode('utf-32-le'), dtype=np.uint32)
+    maze[np.arange(width) < lengths[:, None]] = CELL_TABLE[np.minimum(chars, 255)]
+    return maze
+
+
+# 世界の一覧からステージを作成
+def build_stage(name, worlds, stage_index):
+    mazes = [parse_maze(rows) for change_interval, rows in worlds]
+    intervals = tuple(change_interval for change_interval, rows in worlds)
+    return assemble_stage(name, mazes, intervals, stage_index)
+
+
+# 世界ごとの迷路の配列からステージを作成（一番大きい世界に合わせて壁で埋める）
+def assemble_stage(name, mazes, intervals, stage_index):
+    height = max([maze.shape[0] for maze in mazes] + [1])
+    width = max([maze.shape[1] for maze in mazes] + [1])
+    grid = np.full((len(mazes), height, width), WALL, dtype=np.uint8)
+    for k, maze in enumerate(mazes):
+        grid[k, :maze.shape[0], :maze.shape[1]] = maze
+    sizes = tuple((maze.shape[1], maze.shape[0]) for maze in mazes)
+    return make_stage(name, grid, intervals, stage_index, sizes)
+
+
+# 配列からステージを作成（sizesを省略した場合はすべての世界がgridと同じ大きさ）
+def make_stage(name, grid, intervals, stage_index, sizes=None):
+    start = find_start(grid[0]) if len(grid) else None
+    if sizes is None:
+        sizes = ((grid.shape[2], grid.shape[1]),) * len(grid)
+    return Stage(
+        name=name,
+        grid=grid,
+        cells=grid.tobytes(),
+        intervals=tuple(intervals),
+        width=grid.shape[2],
+        height=grid.shape[1],
+        sizes=tuple(sizes),
+        start=start,
+        goals=np.argwhere(grid == GOAL),
+        walls=grid == WALL,
+        # スタート位置に戻れないのはステージ2以降
+        lock_start=stage_index != 0,
+    )
+
+
+# 名前の中の数字を数として並べるためのキー（Stage2がStage10より前になる）
+def natural_key(name):
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", name)]
+
+
+# ステージ名と世界ファイルのパスの一覧（名前の中の数字の順）
+def list_stage_files(worlds_folder="Worlds"):
+    if not os.path.exists(worlds_folder):
+        raise StageLoadError(f"{worlds_folder}フォルダが存在しません。")
+    stage_files = []
+    stage_names = sorted([d for d in os.listdir(worlds_folder) if os.path.isdir(os.path.join(worlds_folder, d))], key=natural_key)
+    for stage_name in stage_names:
+        stage_path = os.path.join(worlds_folder, stage_name)
+        world_files = sorted([f for f in os.listdir(stage_path) if f.startswith('world') and f.endswith('.txt')], key=natural_key)
+        stage_files.append((stage_name, [os.path.join(stage_path, world_file) for world_file in world_files]))
+    return stage_files
+
+
+# ステージと世界の読み込み（pygameに依存しない）
+def load_stages(worlds_folder="Worlds"):
+    stages = []
+    for stage_index, (stage_name, world_paths) in enumerate(list_stage_files(worlds_folder)):
+        worlds = [read_world(world_path) for world_path in world_paths]
+        stages.append(build_stage(stage_name, worlds, stage_index))
+    return stages
@@ -1,23 +1,47 @@
+import time
+startup_time = time.perf_counter()  # 起動時間の計測用（他のモジュールを読み込む前）
+
 import pygame
 import sys
 import os
-import time
-import json
+import atexit
+from collections import deque
 from pygame.locals import *
 
-# 初期化
-pygame.init()
+import engine
+from frame_scheduler import FrameScheduler
+from history import History
+import replay
+from replay import ReplayRecorder
+from renderer import DirtyRenderer, MazeCache, follow_camera
+from text_cache import TextCache
+from fonts import find_font
+from assets import load_atlas
+from save import SAVE_FILE, SaveWriter, load_save, record_clear
+import event_log
+import hints
+import hot_reload
+from event_log import DEBUG, INFO, WARNING
+import profiler
+from profiler import FrameProfiler
+from level_pack import LevelPack, open_pack
+from levels import FLOOR, WALL, START, GOAL, PLUS, MINUS, StageLoadError
+
+# 初期化（使うサブシステムだけ。音声やジョイスティックは初期化しない）
+pygame.display.init()
+pygame.font.init()
 
 # 画面サイズ
 CELL_SIZE = 40
-MAZE_WIDTH = 10
-MAZE_HEIGHT = 10
+VIEW_WIDTH = 10   # 画面に表示するマス数（大きな迷路はスクロールする）
+VIEW_HEIGHT = 10
 STATUS_HEIGHT = 50
 BUTTON_HEIGHT = 30
 BUTTON_WIDTH = 100
 BUTTON_MARGIN = 10
-SCREEN_WIDTH = CELL_SIZE * MAZE_WIDTH
-SCREEN_HEIGHT = CELL_SIZE * MAZE_HEIGHT + STATUS_HEIGHT
+SCREEN_WIDTH = CELL_SIZE * VIEW_WIDTH
+SCREEN_HEIGHT = CELL_SIZE * VIEW_HEIGHT + STATUS_HEIGHT
+MAZE_VIEW_SIZE = (SCREEN_WIDTH, SCREEN_HEIGHT - STATUS_HEIGHT)
 
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("動的迷路ゲーム")
@@ -35,29 +59,32 @@ YELLOW = (255, 255, 0)  # 特殊マスのメッセージ用
 # 画像フォルダ
 ImageFolder = "Images/"
 
-# 画像の読み込み（画像がない場合は色で代用）
-def load_image(path, fallback_color):
-    try:
-        image = pygame.image.load(os.path.join(ImageFolder, path)).convert_alpha()
-        image = pygame.transform.scale(image, (CELL_SIZE, CELL_SIZE))
-    except:
-        image = pygame.Surface((CELL_SIZE, CELL_SIZE))
-        image.fill(fallback_color)
-    return image
-
-# 画像の読み込み
-player_img = load_image('player.png', BLUE)
-wall_img = load_image('wall.png', BLACK)
-goal_img = load_image('goal.png', GREEN)
-floor_img = load_image('floor.png', WHITE)
-plus_img = load_image('plus.png', (255, 215, 0))   # 金色
-minus_img = load_image('minus.png', (128, 128, 128))  # グレー
+# 画像の読み込み（最初のフレームを表示した後に行う）
+# すべてのタイルを1枚のアトラスにまとめ、縮小済みのものをキャッシュから読む。画像がない場合は色で代用
+player_img = None
+
+def load_assets():
+    global player_img
+    atlas = load_atlas(folder=ImageFolder, cell_size=CELL_SIZE)
+    for status in atlas.problems():
+        print(f"画像 {status.name}: {status.reason}")
+    tiles = atlas.tiles
+    player_img = tiles["player"]
+    tile_images.update({
+        FLOOR: tiles["floor"],
+        WALL: tiles["wall"],
+        START: tiles["floor"],
+        GOAL: tiles["goal"],
+        PLUS: tiles["plus"],
+        MINUS: tiles["minus"],
+    })
 
 # フォント設定（日本語対応）
 def get_japanese_font(size):
     try:
         # 日本語フォントのパスを指定（システムにインストールされている日本語フォントを使用）
-        font_path = pygame.font.match_font('msgothic')  # Windowsの場合 "msgothic"
+        # 探した結果はキャッシュファイルに残り、次回からはフォント一覧を調べない
+        font_path = find_font('msgothic')  # Windowsの場合 "msgothic"
         return pygame.font.Font(font_path, size)
     except:
         # フォールバックフォント
@@ -65,111 +92,125 @@ def get_japanese_font(size):
 
 font = get_japanese_font(24)
 
-# ステージの保存ファイル
-SAVE_FILE = "save.json"
-
-# ステージのロードと保存
-def load_save():
-    if not os.path.exists(SAVE_FILE):
-        return {"unlocked_stage": 1}
-    with open(SAVE_FILE, "r", encoding='utf-8') as f:
-        return json.load(f)
-
-def save_game(data):
-    with open(SAVE_FILE, "w", encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-# ステージと世界の読み込み
-def load_stages(worlds_folder="Worlds"):
-    stages = []
-    if not os.path.exists(worlds_folder):
-        print(f"{worlds_folder}フォルダが存在しません。")
-        pygame.quit()
-        sys.exit()
-    stage_names = sorted([d for d in os.listdir(worlds_folder) if os.path.isdir(os.path.join(worlds_folder, d))])
-    for stage_name in stage_names:
-        stage_path = os.path.join(worlds_folder, stage_name)
-        world_files = sorted([f for f in os.listdir(stage_path) if f.startswith('world') and f.endswith('.txt')])
-        worlds = []
-        for world_file in world_files:
-            world_path = os.path.join(stage_path, world_file)
-            with open(world_path, "r", encoding='utf-8') as wf:
-                lines = wf.readlines()
-                if not lines:
-                    print(f"{world_path} は空です。")
-                    pygame.quit()
-                    sys.exit()
-                try:
-                    change_interval = int(lines[0].strip())
-                except ValueError:
-                    print(f"{world_path} の一行目は整数でなければなりません。")
-                    pygame.quit()
-                    sys.exit()
-                maze = [list(line.strip()) for line in lines[1:]]
-                # Pad maze to MAZE_HEIGHT and MAZE_WIDTH if necessary
-                while len(maze) < MAZE_HEIGHT:
-                    maze.append(['1'] * MAZE_WIDTH)
-                for row in maze:
-                    while len(row) < MAZE_WIDTH:
-                        row.append('1')
-                worlds.append({"maze": maze, "change_interval": change_interval})
-        stages.append({"name": stage_name, "worlds": worlds})
-    return stages
+# 描画済み文字のキャッシュ
+TEXT_CACHE_SIZE = 128
+text_cache = TextCache(TEXT_CACHE_SIZE)
 
-# 迷路の描画
-def draw_maze(screen, maze):
-    for y in range(MAZE_HEIGHT):
-        for x in range(MAZE_WIDTH):
-            if y >= len(maze) or x >= len(maze[y]):
-                continue  # 範囲外のセルは無視
-            cell = maze[y][x]
-            pos = (x * CELL_SIZE, y * CELL_SIZE)
-            if cell == '1':
-                screen.blit(wall_img, pos)
-            elif cell == '0' or cell == 'S':
-                screen.blit(floor_img, pos)
-            elif cell == 'G':
-                screen.blit(goal_img, pos)
-            elif cell == '+':
-                screen.blit(plus_img, pos)
-            elif cell == '-':
-                screen.blit(minus_img, pos)
-            else:
-                screen.blit(floor_img, pos)  # 未定義のセルは床として描画
-
-# スタート位置の検索
-def find_start(maze):
-    for y, row in enumerate(maze):
-        for x, cell in enumerate(row):
-            if cell == 'S':
-                return x, y
-    return None
+# 出来事の記録（書き込みは別スレッドで行う。設定は環境変数 SWAPWORLD_LOG など）
+log = event_log.from_env()
+event_log.install_crash_dump(log)
+atexit.register(log.close)
 
-# リセット関数
-def reset_game():
-    global current_stage_index, current_world_index, move_count, player_x, player_y, undo_stack, redo_stack, game_clear, change_interval, is_stuck, special_message, special_message_timer
-    current_stage_index = 0
-    current_world_index = 0
-    current_stage = stages[current_stage_index]
-    current_world = current_stage["worlds"][current_world_index]
-    start_pos = find_start(current_world["maze"])
-    if start_pos is None:
-        print(f"{current_stage['name']}のworld{current_world_index +1}.txtにスタート位置 'S' が見つかりません。")
+# ステージの保存（書き込みは別スレッドでまとめて行い、終了時には必ず書き込む）
+save_writer = SaveWriter(SAVE_FILE)
+atexit.register(save_writer.close)
+
+def save_game():
+    save_data["unlocked_stage"] = unlocked_stage
+    save_writer.save(save_data)
+
+# 迷路の描画
+# セルの種類ごとの画像（未定義の文字は読み込み時に床になっている。中身はload_assetsで入れる）
+tile_images = {}
+
+# 迷路画像のチャンクごとのキャッシュと、差分描画
+maze_cache = MazeCache(tile_images, CELL_SIZE)
+renderer = DirtyRenderer(screen)
+maze_view = renderer.background.subsurface(pygame.Rect((0, 0), MAZE_VIEW_SIZE))
+
+# ステージの開始
+def start_stage(stage_index):
+    global current_stage_index, stage, state, history, special_message, special_message_timer, is_moving, is_transitioning, stage_start_time, stage_reloaded
+    current_stage_index = stage_index
+    stage = stages[current_stage_index]
+    # ヒントの表（ステージを選んだときに別スレッドで読み込む。キャッシュがなければ作る）
+    start_hint_loader()
+    try:
+        state = engine.initial_state(stage)
+    except StageLoadError as e:
+        print(e)
         pygame.quit()
         sys.exit()
-    player_x, player_y = start_pos
-    move_count = 0
-    undo_stack = []
-    redo_stack = []
-    game_clear = False
-    change_interval = current_world["change_interval"]
-    is_stuck = False
+    history = History(stage, state, HISTORY_MAX_MOVES)
     special_message = ""
     special_message_timer = 0
+    is_moving = False
+    is_transitioning = False
+    input_queue.clear()
+    stage_start_time = time.monotonic()
+    stage_reloaded = False
+    invalidate_background()
+
+# 列にたまっている移動キーを実行する（移動できない入力は捨てる）
+# start_timeは前のアニメーションが終わった時刻（フレームの途中で終わった分も次の動きに引き継ぐ）
+def start_queued_move(start_time):
+    global is_moving, move_start_time, move_action, start_pos_anim, end_pos_anim, current_move_duration
+    while input_queue:
+        action, queued_time = input_queue.popleft()
+        result = engine.check_move(stage, state, action)
+        if result != engine.MOVE_OK:
+            log.emit(DEBUG, event_log.BLOCKED, reason=BLOCKED_REASONS.get(result, result))
+            continue
+
+        # 移動アニメーション開始（操作の記録は移動が終わって手を実行したときに行う）
+        dx, dy = engine.DIRECTIONS[action]
+        is_moving = True
+        move_start_time = max(start_time, queued_time)
+        move_action = action
+        start_pos_anim = (state.x, state.y)
+        end_pos_anim = (state.x + dx, state.y + dy)
+        current_move_duration = 0 if animation_skipped() else move_duration
+        log.emit(DEBUG, event_log.MOVE_START, stage=stage.name, world=state.world + 1, start=start_pos_anim, end=end_pos_anim,
+                 latency=move_start_time - queued_time, queued=len(input_queue))
+        return
+
+def animation_skipped():
+    return ANIMATION_SKIP_DEPTH > 0 and len(input_queue) > ANIMATION_SKIP_DEPTH
+
+def animation_progress(start_time, duration):
+    if duration <= 0:
+        return 1
+    return min((scheduler.now - start_time) / duration, 1)
+
+# リセット関数
+def reset_game():
+    start_stage(current_stage_index)
+
+# ヒント（最善の次の一手とゴールまでの手数、次の世界の変化で埋まってしまう方向）
+hint_loader = None
+HINT_KEYS = "WSAD"
+
+def start_hint_loader():
+    global hint_loader
+    if hint_loader is None or hint_loader.stage is not stage:
+        if hint_loader is not None:
+            hint_loader.cancel()
+        hint_loader = hints.HintLoader(stage, log=log)
+
+def hint_message():
+    if state.is_stuck:
+        return "ヒント: 埋まっています。Undoしてください"
+    hint_table = hint_loader.table
+    hint = None if hint_table is None else hint_table.lookup(state)
+    if not hint_loader.enabled:
+        message = "ヒント: このステージは大きすぎるため使えません"
+    elif hint_loader.error is not None:
+        message = "ヒント: 表を作れませんでした"
+    elif hint_table is None:
+        message = "ヒント: 準備中です"
+    elif hint is None:
+        message = "ヒント: ゴールに行けません"
+    else:
+        action, distance = hint
+        message = f"ヒント: {HINT_KEYS[action]} 残り{distance}手"
+    stuck = hints.stuck_moves(stage, state)
+    if stuck:
+        message += f" 埋まる:{','.join(HINT_KEYS[action] for action in stuck)}"
+    return message
 
-# UndoとRedoのスタック
-undo_stack = []
-redo_stack = []
+# UndoとRedoの履歴（記録する最大の手数）
+HISTORY_MAX_MOVES = 100000
+history = None
 
 # ステージ選択画面の状態
 stage_selection = True
@@ -177,15 +218,38 @@ stage_selection = True
 # ゲームの状態
 game_running = False
 
-# ゲームクリアフラグ
-game_clear = False
+# 環境変数の数値（読めない値や範囲外の値の場合は既定値を使う）
+def env_number(name, default, convert, valid):
+    text = os.environ.get(name)
+    if text is None:
+        return default
+    try:
+        value = convert(text)
+    except ValueError:
+        value = None
+    if value is None or not valid(value):
+        print(f"{name}={text} は使えません。既定値 {default} を使います。")
+        return default
+    return value
+
+# アニメーションの速さ（倍率。時間で進めるのでフレームレートには依存しない）
+ANIMATION_SPEED = env_number("SWAPWORLD_ANIMATION_SPEED", 1.0, float, lambda value: 0 < value < float("inf"))
+
+# アニメーション中の移動キーの入力を順に実行する列
+# 入力から移動開始までの遅れは最大でも INPUT_QUEUE_SIZE * (move_duration + transition_duration)
+INPUT_QUEUE_SIZE = 8
+input_queue = deque()
+# 列にこれより多くたまっている間はアニメーションを省略する（0なら省略しない）
+ANIMATION_SKIP_DEPTH = env_number("SWAPWORLD_ANIMATION_SKIP_DEPTH", 0, int, lambda value: value >= 0)
 
 # 移動アニメーション用
 is_moving = False
 move_start_time = 0
-move_duration = 0.3  # 0.3秒
+move_duration = 0.3 / ANIMATION_SPEED  # 0.3秒
+current_move_duration = move_duration
 start_pos_anim = (0, 0)
 end_pos_anim = (0, 0)
+move_action = None
 current_pos_anim = (0, 0)
 display_x = 0
 display_y = 0
@@ -193,14 +257,14 @@ display_y = 0
 # 世界の変化アニメーション用
 is_transitioning = False
 transition_start_time = 0
-transition_duration = 0.3  # 0.3秒
+transition_duration = 0.3 / ANIMATION_SPEED  # 0.3秒
+current_transition_duration = transition_duration
 current_maze_surface = None
 next_maze_surface = None
 alpha = 0
 
 # リセットボタンの設定（ゲーム中）
 def create_reset_button():
-    button_font = get_japanese_font(24)
     button_text = "リセット"
     button_color = GRAY
     # リセットボタンを画面下部に配置
@@ -208,91 +272,294 @@ def create_reset_button():
     return button_text, button_color, button_rect
 
 button_text, button_color, button_rect = create_reset_button()
-
-# ステージクリア時のステージアンロック
-def unlock_next_stage():
+button_text_surface = text_cache.render(font, button_text, BLACK)
+button_text_rect = button_text_surface.get_rect(center=button_rect.center)
+
+# ゲーム画面の背景（迷路とリセットボタン）。ステージ、世界、カメラ位置で判定する
+background_key = None
+
+def draw_background(world, camera):
+    background = renderer.background
+    background.fill(BLACK)
+    maze_cache.draw_view(maze_view, stage, world, camera)
+    pygame.draw.rect(background, button_color, button_rect)
+    background.blit(button_text_surface, button_text_rect)
+    renderer.invalidate()
+
+# 世界の変化中の背景（変化前後の迷路を重ねる）
+def draw_transition_background():
+    background = renderer.background
+    background.fill(BLACK)
+    background.blit(current_maze_surface, (0, 0))
+    background.blit(next_maze_surface, (0, 0))
+    pygame.draw.rect(background, button_color, button_rect)
+    background.blit(button_text_surface, button_text_rect)
+    renderer.invalidate()
+
+# 見えている部分の迷路の画像
+def render_maze_view(world, camera):
+    surface = pygame.Surface(MAZE_VIEW_SIZE)
+    surface.fill(BLACK)
+    maze_cache.draw_view(surface, stage, world, camera)
+    return surface
+
+def invalidate_background():
+    global background_key
+    background_key = None
+
+# ステージ選択画面の再描画が必要か
+stage_select_dirty = True
+
+# 前景の文字（内容が変わったときだけ描き直す）
+status_key = None
+status_surface = None
+clear_surface = text_cache.render(font, "クリア！おめでとうございます！", GREEN)
+clear_pos = (SCREEN_WIDTH // 2 - clear_surface.get_width() // 2, SCREEN_HEIGHT // 2 - clear_surface.get_height() // 2)
+
+# ステージクリア時の記録とステージアンロック（クリアした手で1回だけ呼ぶ）
+# 途中でステージが再読み込みされた場合は、手数が数え直しになっていて迷路も違うので、クリアの回数だけ数える
+def on_stage_clear():
     global unlocked_stage
-    if current_stage_index + 1 > unlocked_stage and current_stage_index + 1 <= len(stages):
-        unlocked_stage += 1
-        save_game({"unlocked_stage": unlocked_stage})
-        print(f"ステージ {current_stage['name']} をクリアしました！次のステージが解放されました。")
+    seconds = time.monotonic() - stage_start_time
+    log.emit(INFO, event_log.CLEAR, stage=stage.name, moves=history.position, seconds=seconds)
+    if stage_reloaded:
+        record_clear(save_data, stage.name, None, None)
+    elif record_clear(save_data, stage.name, history.position, seconds):
+        log.emit(INFO, event_log.RECORD, stage=stage.name, moves=history.position, seconds=seconds)
+    next_stage_num = current_stage_index + 2
+    if next_stage_num > unlocked_stage and next_stage_num <= len(stages):
+        unlocked_stage = next_stage_num
+        log.emit(INFO, event_log.UNLOCK, stage=stage.name, unlocked_stage=unlocked_stage)
+    save_game()
 
 # 特殊マス到達時のメッセージ
 special_message = ""
 special_message_timer = 0  # メッセージの表示時間（秒）
 
-# ゲーム状態を保存
-def save_game_state():
-    return {
-        "player_x": player_x,
-        "player_y": player_y,
-        "current_stage_index": current_stage_index,
-        "current_world_index": current_world_index,
-        "move_count": move_count,
-        "change_interval": change_interval,
-        "is_stuck": is_stuck
-    }
-
-# ゲーム状態を復元
-def load_game_state(state):
-    global player_x, player_y, current_stage_index, current_world_index, move_count, change_interval, is_stuck, current_stage, current_world
-    player_x = state.get("player_x", player_x)
-    player_y = state.get("player_y", player_y)
-    current_stage_index = state.get("current_stage_index", current_stage_index)
-    current_world_index = state.get("current_world_index", current_world_index)
-    move_count = state.get("move_count", move_count)
-    change_interval = state.get("change_interval", change_interval)
-    is_stuck = state.get("is_stuck", is_stuck)
-    
-    # 現在のステージと世界を更新
-    if 0 <= current_stage_index < len(stages):
-        current_stage = stages[current_stage_index]
-        if 0 <= current_world_index < len(current_stage["worlds"]):
-            current_world = current_stage["worlds"][current_world_index]
-        else:
-            print(f"無効な世界インデックス: {current_world_index}")
-            pygame.quit()
-            sys.exit()
-    else:
-        print(f"無効なステージインデックス: {current_stage_index}")
-        pygame.quit()
-        sys.exit()
+# 最初のフレーム（読み込み中の表示）を先に出してから、ステージと画像を読み込む
+screen.fill(BLACK)
+loading_text = text_cache.render(font, "読み込み中...", WHITE)
+screen.blit(loading_text, (SCREEN_WIDTH // 2 - loading_text.get_width() // 2, SCREEN_HEIGHT // 2 - loading_text.get_height() // 2))
+pygame.display.flip()
+first_frame_time = time.perf_counter()
 
 # ロード
-stages = load_stages()
-save_data = load_save()
+load_assets()
+try:
+    # ステージパックを開く（迷路はステージ選択時に展開される）
+    stages = open_pack()
+    if not stages:
+        raise StageLoadError("ステージがありません。")
+except StageLoadError as e:
+    print(e)
+    pygame.quit()
+    sys.exit()
+save_data = load_save(SAVE_FILE)
 unlocked_stage = save_data.get("unlocked_stage", 1)
 
 # ステージをロードして初期化
-current_stage_index = 0
-current_world_index = 0
-current_stage = stages[current_stage_index]
-current_world = current_stage["worlds"][current_world_index]
-start_pos = find_start(current_world["maze"])
-if start_pos is None:
-    print(f"{current_stage['name']}のworld{current_world_index +1}.txtにスタート位置 'S' が見つかりません。")
+start_stage(0)
+ready_time = time.perf_counter()
+
+# 起動時間の計測（--startup-timeを付けると表示して終了する）
+if "--startup-time" in sys.argv[1:]:
+    print(f"最初のフレームまで: {first_frame_time - startup_time:.3f}秒")
+    print(f"操作できるまで: {ready_time - startup_time:.3f}秒")
     pygame.quit()
     sys.exit()
-player_x, player_y = start_pos
-move_count = 0
 
-# change_intervalの定義
-change_interval = current_world["change_interval"]
-
-# is_stuckの定義
-is_stuck = False
+# 操作の記録（終了時やエラー時に保存する）
+recorder = ReplayRecorder(stages.digest)
+atexit.register(recorder.save)
+
+# ステージ開始からのミリ秒（操作の記録用）
+def stage_time_ms():
+    return int((time.monotonic() - stage_start_time) * 1000)
+
+# 世界ファイルの再読み込み（--hot-reloadを付けると、保存した世界ファイルをすぐにゲームに反映する）
+# 監視スレッドが変更を見つけたらRELOAD_EVENTを送り、変更されたファイルのステージだけを作り直す
+WORLDS_FOLDER = "Worlds"
+RELOAD_EVENT = pygame.event.custom_type()
+world_watcher = None
+if "--hot-reload" in sys.argv[1:]:
+    world_watcher = hot_reload.WorldWatcher(WORLDS_FOLDER, lambda: pygame.event.post(pygame.event.Event(RELOAD_EVENT)))
+    atexit.register(world_watcher.close)
+    print(f"{WORLDS_FOLDER} の変更を監視しています（{world_watcher.method}）。")
+
+# 再読み込みでステージを最初からやり直す（ステージの時刻も0に戻るので、リプレイにはステージの選択として記録する）
+def restart_stage(stage_index):
+    recorder.record(0, replay.SELECT, stage_index)
+    start_stage(stage_index)
+
+# 再読み込みで作り直したステージを続ける
+# プレイヤーの状態が新しい迷路でも使えればそのまま続け（移動中の手は取り消す）、使えなければ最初からやり直す
+def continue_reloaded_stage(stage_index):
+    global current_stage_index, stage, state, history, is_moving, is_transitioning, current_maze_surface, next_maze_surface, stage_reloaded
+    kept = None if state.game_clear else hot_reload.keep_state(stages[stage_index], state)
+    if kept is None:
+        restart_stage(stage_index)
+        return
+    current_stage_index = stage_index
+    stage = stages[stage_index]
+    state = kept
+    history = History(stage, state, HISTORY_MAX_MOVES)
+    stage_reloaded = True
+    start_hint_loader()
+    is_moving = False
+    is_transitioning = False
+    current_maze_surface = None
+    next_maze_surface = None
+    input_queue.clear()
+    invalidate_background()
+
+# ステージの追加や削除があったときは、パックを別スレッドで作り直し（pack_builder）、できあがったら差し替える
+# 作り直している間に変更されたファイルは、差し替えた後にもう一度読み込む
+pack_builder = None
+build_changes = set()
+
+def start_pack_build():
+    global pack_builder, build_changes
+    if pack_builder is not None and not pack_builder.done:
+        return
+    pack_builder = hot_reload.PackBuilder(WORLDS_FOLDER, stages.path + ".new", lambda: pygame.event.post(pygame.event.Event(RELOAD_EVENT)))
+    build_changes = set()
+
+# 遊べるステージがなくなったときは、ステージ選択画面に戻る
+def leave_stage():
+    global stage_selection, game_running, is_moving, is_transitioning
+    stage_selection = True
+    game_running = False
+    is_moving = False
+    is_transitioning = False
+    input_queue.clear()
+
+# できあがったパックに差し替える（戻り値は作り直している間に変更されたファイル）
+def finish_pack_build():
+    global stages, stage, current_stage_index, pack_builder
+    builder = pack_builder
+    pack_builder = None
+    if builder.error is not None:
+        log.emit(WARNING, event_log.RELOAD_ERROR, error=str(builder.error))
+        return build_changes
+    begin = time.perf_counter()
+    # Windowsではメモリマップしたままのファイルを置き換えられないので、先に閉じる（失敗したら開き直す）
+    stages.close()
+    try:
+        os.replace(builder.pack_path, stages.path)
+        new_stages = LevelPack(stages.path)
+    except (StageLoadError, OSError) as e:
+        log.emit(WARNING, event_log.RELOAD_ERROR, error=str(e))
+        stages = stages.reopen()
+        return build_changes
+    stages = new_stages
+    maze_cache.invalidate()
+    if not stages:
+        leave_stage()
+    elif stage.name not in stages.names:
+        # 今のステージが消えた場合は、同じ番号のステージ（解放済みの範囲に収める）をやり直す
+        restart_stage(max(min(current_stage_index, len(stages) - 1, unlocked_stage - 1), 0))
+    else:
+        stage_index = stages.names.index(stage.name)
+        if hints.stage_hash(stages[stage_index]) == hints.stage_hash(stage):
+            # 今のステージの内容が変わっていなければ、状態も履歴もそのまま
+            current_stage_index = stage_index
+            stage = stages[stage_index]
+            history.stage = stage
+            start_hint_loader()
+        else:
+            continue_reloaded_stage(stage_index)
+    log.emit(INFO, event_log.RELOAD, stages=",".join(stages.names), seconds=time.perf_counter() - begin)
+    return build_changes
+
+def reload_worlds():
+    global stage_select_dirty
+    paths = world_watcher.take_changes()
+    if pack_builder is not None:
+        if not pack_builder.done:
+            build_changes.update(paths)
+        else:
+            paths |= finish_pack_build()
+            stage_select_dirty = True
+    if not paths:
+        return
+    begin = time.perf_counter()
+    reloaded, errors = hot_reload.reload_stages(stages, WORLDS_FOLDER, paths)
+    for error in errors:
+        log.emit(WARNING, event_log.RELOAD_ERROR, error=error)
+    if reloaded is None:
+        start_pack_build()
+        return
+    for index in reloaded:
+        maze_cache.invalidate(stages.names[index])
+    if current_stage_index in reloaded:
+        continue_reloaded_stage(current_stage_index)
+    stage_select_dirty = True
+    if reloaded:
+        log.emit(INFO, event_log.RELOAD, stages=",".join(stages.names[index] for index in reloaded), seconds=time.perf_counter() - begin)
 
 # メインループ
-clock = pygame.time.Clock()
-
+# アニメーション中だけ60FPSで回し、それ以外はイベントを待つ
+FPS = 60
+scheduler = FrameScheduler(FPS)
+
+# フレームごとの処理時間の計測（F3で計測と表示、F4でトレースファイルに書き出す）
+frame_profiler = FrameProfiler()
+PROFILE_OVERLAY_INTERVAL = 0.25  # 表示の更新間隔（秒）
+profile_surface = None
+profile_surface_time = 0
+
+# 移動できなかった理由（記録用）
+BLOCKED_REASONS = {
+    engine.BLOCKED_CLEAR: "clear",
+    engine.BLOCKED_WALL: "wall",
+    engine.BLOCKED_STUCK: "stuck",
+    engine.BLOCKED_BOUNDS: "bounds",
+    engine.BLOCKED_START: "start",
+}
+
+# WASDと行動の対応
+MOVE_KEYS = {
+    pygame.K_w: engine.UP,
+    pygame.K_s: engine.DOWN,
+    pygame.K_a: engine.LEFT,
+    pygame.K_d: engine.RIGHT,
+}
+
+events = pygame.event.get()
 while True:
-    dt = clock.tick(60) / 1000  # 秒単位
-    for event in pygame.event.get():
+    dt = scheduler.begin_frame()  # 秒単位
+    frame_profiler.begin_frame()
+
+    # メッセージタイマーの更新（描画の前に消す。このフレームのイベントで出したメッセージは減らさない）
+    if special_message:
+        special_message_timer -= dt
+        if special_message_timer <= 0:
+            special_message = ""
+
+    for event in events:
         if event.type == pygame.QUIT:
-            save_game({"unlocked_stage": unlocked_stage})
+            save_game()
             pygame.quit()
             sys.exit()
 
+        # 世界ファイルの再読み込み
+        if event.type == RELOAD_EVENT:
+            reload_worlds()
+            continue
+
+        # 処理時間の計測
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            frame_profiler.toggle()
+            profile_surface = None
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+            count = frame_profiler.export_chrome_trace()
+            log.emit(INFO, event_log.TRACE, path=profiler.TRACE_FILE, count=count)
+
+        # ウィンドウが隠れていた場合は全体を描き直す
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            stage_select_dirty = True
+            renderer.invalidate()
+
         if stage_selection:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
@@ -300,136 +567,101 @@ while True:
                     sys.exit()
             if event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_pos = event.pos
-                for idx, stage in enumerate(stages):
+                for idx, stage_name in enumerate(stages.names):
                     stage_num = idx + 1
                     if stage_num > unlocked_stage:
                         continue  # ロックされているステージは無視
                     stage_rect = pygame.Rect(50, 80 + idx * 60, SCREEN_WIDTH - 100, 50)
                     if stage_rect.collidepoint(mouse_pos):
                         # ステージを選択
-                        current_stage_index = idx
-                        current_stage = stages[current_stage_index]
-                        current_world_index = 0
-                        current_world = current_stage["worlds"][current_world_index]
-                        start_pos = find_start(current_world["maze"])
-                        if start_pos is None:
-                            print(f"{current_stage['name']}のworld{current_world_index +1}.txtにスタート位置 'S' が見つかりません。")
-                            pygame.quit()
-                            sys.exit()
-                        player_x, player_y = start_pos
-                        move_count = 0
-                        undo_stack = []
-                        redo_stack = []
-                        game_clear = False
+                        recorder.record(0, replay.SELECT, idx)
+                        start_stage(idx)
                         stage_selection = False
                         game_running = True
-                        change_interval = current_world["change_interval"]
-                        is_stuck = False
-                        special_message = ""
-                        special_message_timer = 0
                         break
 
             # ステージ選択中は他のイベントを無視
             continue
 
         elif game_running:
-            if not game_clear and not is_moving and not is_transitioning:
+            if not state.game_clear and event.type == pygame.KEYDOWN and event.key in MOVE_KEYS:
+                # 移動キーはアニメーション中も受け付けて列に入れる（満杯のときは捨てる）
+                if len(input_queue) < INPUT_QUEUE_SIZE:
+                    input_queue.append((MOVE_KEYS[event.key], scheduler.now))
+                else:
+                    log.emit(DEBUG, event_log.BLOCKED, reason="queue_full")
+            elif not state.game_clear and not is_moving and not is_transitioning:
                 if event.type == pygame.KEYDOWN:
-                    dx, dy = 0, 0
-                    if event.key == pygame.K_w:
-                        dy = -1
-                    elif event.key == pygame.K_s:
-                        dy = 1
-                    elif event.key == pygame.K_a:
-                        dx = -1
-                    elif event.key == pygame.K_d:
-                        dx = 1
-                    elif event.key == pygame.K_z and (pygame.key.get_mods() & pygame.KMOD_CTRL):
+                    if event.key == pygame.K_z and (pygame.key.get_mods() & pygame.KMOD_CTRL):
                         # Ctrl+ZでUndo
-                        if undo_stack:
-                            last_state = undo_stack.pop()
-                            redo_stack.append(save_game_state())
-                            load_game_state(last_state)
-                            print(f"Undo: ステージ {stages[current_stage_index]['name']}, 世界 {current_world_index +1}, プレイヤー位置 ({player_x}, {player_y})")
+                        if history.can_undo():
+                            recorder.record(stage_time_ms(), replay.UNDO)
+                            state = history.undo()
+                            log.emit(INFO, event_log.UNDO, stage=stage.name, world=state.world + 1, x=state.x, y=state.y)
                     elif event.key == pygame.K_y and (pygame.key.get_mods() & pygame.KMOD_CTRL):
                         # Ctrl+YでRedo
-                        if redo_stack:
-                            next_state = redo_stack.pop()
-                            undo_stack.append(save_game_state())
-                            load_game_state(next_state)
-                            print(f"Redo: ステージ {stages[current_stage_index]['name']}, 世界 {current_world_index +1}, プレイヤー位置 ({player_x}, {player_y})")
-
-                    if dx != 0 or dy != 0:
-                        if is_stuck:
-                            print("プレイヤーが埋まっているため、移動できません。UndoまたはRedoを使用してください。")
-                            continue  # 移動をブロック
-                        new_x = player_x + dx
-                        new_y = player_y + dy
-
-                        # 境界チェック
-                        if new_y < 0 or new_y >= MAZE_HEIGHT or new_x < 0 or new_x >= MAZE_WIDTH:
-                            print("その方向には進めません。")
-                        else:
-                            cell = current_world["maze"][new_y][new_x]
-                            if cell != '1':
-                                # スタート位置の制約（ステージ1のみ）
-                                if current_stage_index != 0 and cell == 'S':
-                                    print("スタート位置に戻ることはできません。")
-                                else:
-                                    # 移動履歴を保存
-                                    undo_stack.append(save_game_state())
-                                    redo_stack.clear()
-
-                                    # 移動アニメーション開始
-                                    is_moving = True
-                                    move_start_time = time.time()
-                                    start_pos_anim = (player_x, player_y)
-                                    end_pos_anim = (new_x, new_y)
-                                    print(f"移動開始: ステージ {stages[current_stage_index]['name']}, 世界 {current_world_index +1}, プレイヤー位置 ({player_x}, {player_y}) -> ({new_x}, {new_y})")
+                        if history.can_redo():
+                            recorder.record(stage_time_ms(), replay.REDO)
+                            state = history.redo()
+                            log.emit(INFO, event_log.REDO, stage=stage.name, world=state.world + 1, x=state.x, y=state.y)
+
+                    elif event.key == pygame.K_h:
+                        # Hでヒント
+                        special_message = hint_message()
+                        special_message_timer = 3  # 3秒間表示
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
-                    save_game({"unlocked_stage": unlocked_stage})
+                    save_game()
                     pygame.quit()
                     sys.exit()
 
             if event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_pos = event.pos
                 if button_rect.collidepoint(mouse_pos):
+                    recorder.record(0, replay.RESET)
                     reset_game()
                     game_running = True  # ゲームを再開
 
+    frame_profiler.mark(profiler.EVENTS)
+
     # アニメーションと描画処理
     if stage_selection:
-        # ステージ選択画面の描画
-        screen.fill(BLACK)
-        title_text = font.render("ステージ選択", True, WHITE)
-        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 20))
-
-        # 各ステージボタンの描画
-        for idx, stage in enumerate(stages):
-            stage_num = idx + 1
-            stage_name = stage["name"]
-            if stage_num <= unlocked_stage:
-                button_color_stage = GREEN
-                clickable = True
-            else:
-                button_color_stage = GRAY
-                clickable = False
-
-            stage_rect_stage = pygame.Rect(50, 80 + idx * 60, SCREEN_WIDTH - 100, 50)
-            pygame.draw.rect(screen, button_color_stage, stage_rect_stage)
-            stage_text = f"{stage_name} {'(解放済み)' if stage_num <= unlocked_stage else '(ロック中)'}"
-            stage_text_surface = font.render(stage_text, True, BLACK)
-            text_rect = stage_text_surface.get_rect(center=stage_rect_stage.center)
-            screen.blit(stage_text_surface, text_rect)
-
-        pygame.display.flip()
+        # ステージ選択画面の描画（変化があったときだけ）
+        if stage_select_dirty:
+            stage_select_dirty = False
+            screen.fill(BLACK)
+            title_text = text_cache.render(font, "ステージ選択", WHITE)
+            screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 20))
+
+            # 各ステージボタンの描画
+            for idx, stage_name in enumerate(stages.names):
+                stage_num = idx + 1
+                if stage_num <= unlocked_stage:
+                    button_color_stage = GREEN
+                    clickable = True
+                else:
+                    button_color_stage = GRAY
+                    clickable = False
+
+                stage_rect_stage = pygame.Rect(50, 80 + idx * 60, SCREEN_WIDTH - 100, 50)
+                pygame.draw.rect(screen, button_color_stage, stage_rect_stage)
+                stage_text = f"{stage_name} {'(解放済み)' if stage_num <= unlocked_stage else '(ロック中)'}"
+                stage_text_surface = text_cache.render(font, stage_text, BLACK)
+                text_rect = stage_text_surface.get_rect(center=stage_rect_stage.center)
+                screen.blit(stage_text_surface, text_rect)
+            frame_profiler.mark(profiler.TEXT)
+
+            pygame.display.flip()
+            frame_profiler.mark(profiler.DISPLAY)
 
     elif game_running:
+        # 止まっているときは列の入力をすぐに実行する
+        if not is_moving and not is_transitioning and not state.game_clear:
+            start_queued_move(scheduler.now)
+
         # 移動アニメーションの処理
         if is_moving:
-            elapsed = time.time() - move_start_time
-            t = min(elapsed / move_duration, 1)  # 0 <= t <= 1
+            t = animation_progress(move_start_time, current_move_duration)  # 0 <= t <= 1
             interp_x = start_pos_anim[0] + (end_pos_anim[0] - start_pos_anim[0]) * t
             interp_y = start_pos_anim[1] + (end_pos_anim[1] - start_pos_anim[1]) * t
 
@@ -440,69 +672,61 @@ while True:
             if t >= 1:
                 # 移動完了
                 is_moving = False
-                player_x, player_y = end_pos_anim
-                move_count += 1
-                print(f"移動完了: ステージ {stages[current_stage_index]['name']}, 世界 {current_world_index +1}, プレイヤー位置 ({player_x}, {player_y})")
+                move_end_time = move_start_time + current_move_duration
+                prev_state = state
+                state = engine.apply_move(stage, state, move_action)
+                recorder.record(stage_time_ms(), move_action)
+                # 移動履歴を保存
+                history.push(move_action, state)
+                log.emit(INFO, event_log.MOVE, stage=stage.name, world=prev_state.world + 1, x=state.x, y=state.y, action=move_action)
 
                 # ゴールチェック
-                current_maze = current_world["maze"]
-                cell = current_maze[player_y][player_x]
-                if cell == 'G':
-                    game_clear = True
-                    print("ゴールに到達しました！")
+                cell = stage.grid[prev_state.world, state.y, state.x]
+                if state.game_clear:
+                    on_stage_clear()
 
                 # 新しいマスのチェック
-                if cell == '+':
-                    change_interval += 1
+                if cell == PLUS:
                     special_message = "+マスに到達！世界変化までのカウントが1増加しました。"
                     special_message_timer = 2  # 2秒間表示
-                    print("+マスに到達しました！世界変化までのカウントが1増加しました。")
-                elif cell == '-':
-                    if change_interval > 1:
-                        change_interval -= 1
+                    log.emit(INFO, event_log.SPECIAL, cell="+", change_interval=state.change_interval)
+                elif cell == MINUS:
+                    if prev_state.change_interval > 1:
                         special_message = "−マスに到達！世界変化までのカウントが1減少しました。"
                         special_message_timer = 2  # 2秒間表示
-                        print("−マスに到達しました！世界変化までのカウントが1減少しました。")
+                        log.emit(INFO, event_log.SPECIAL, cell="-", change_interval=state.change_interval)
                     else:
                         special_message = "−マスに到達しましたが、カウントはこれ以上減少できません。"
                         special_message_timer = 2  # 2秒間表示
-                        print("−マスに到達しましたが、カウントはこれ以上減少できません。")
+                        log.emit(INFO, event_log.SPECIAL, cell="-", change_interval=state.change_interval)
 
                 # 世界の変化チェック
-                if move_count >= change_interval and not game_clear:
-                    move_count = 0
+                if engine.world_changed(state):
                     # 世界の変化を開始
                     is_transitioning = True
-                    transition_start_time = time.time()
+                    transition_start_time = move_end_time
+                    current_transition_duration = 0 if animation_skipped() else transition_duration
 
-                    # 現在の迷路を描画したSurfaceを作成
-                    current_maze_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT - STATUS_HEIGHT))
-                    draw_maze(current_maze_surface, current_maze)
+                    # 変化前後の迷路（見えている部分だけ描画して透明度を設定する）
+                    camera = follow_camera(stage, state.x, state.y, CELL_SIZE, MAZE_VIEW_SIZE)
+                    current_maze_surface = render_maze_view(prev_state.world, camera)
                     current_maze_surface.set_alpha(255)
-
-                    # 次の世界を決定
-                    current_world_index = (current_world_index + 1) % len(current_stage["worlds"])
-                    current_world = current_stage["worlds"][current_world_index]
-                    change_interval = current_world["change_interval"]
-
-                    # 新しい迷路を描画したSurfaceを作成
-                    next_maze_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT - STATUS_HEIGHT))
-                    draw_maze(next_maze_surface, current_world["maze"])
+                    next_maze_surface = render_maze_view(state.world, camera)
                     next_maze_surface.set_alpha(0)
 
-                    print(f"世界が変化しました。ステージ {stages[current_stage_index]['name']}, 世界 {current_world_index +1}")
+                    log.emit(INFO, event_log.FLIP, stage=stage.name, world=state.world + 1)
 
                     # 新しい世界でのプレイヤー位置チェック
-                    new_cell = current_world["maze"][player_y][player_x]
-                    if new_cell == '1':
-                        is_stuck = True
-                        print("変化後、プレイヤーが壁に埋まってしまいました。移動が制限されます。")
-                    else:
-                        is_stuck = False
+                    if state.is_stuck:
+                        log.emit(WARNING, event_log.STUCK, stage=stage.name, world=state.world + 1, x=state.x, y=state.y)
+                elif state.game_clear:
+                    input_queue.clear()
+                else:
+                    # 次の入力があれば続けて動く
+                    start_queued_move(move_end_time)
 
         elif is_transitioning:
-            elapsed = time.time() - transition_start_time
-            t = min(elapsed / transition_duration, 1)  # 0 <= t <= 1
+            t = animation_progress(transition_start_time, current_transition_duration)  # 0 <= t <= 1
 
             # フェードアウト
             current_maze_surface.set_alpha(max(255 - int(255 * t), 0))
@@ -513,71 +737,68 @@ while True:
                 is_transitioning = False
                 current_maze_surface = None
                 next_maze_surface = None
-                print(f"世界の変化が完了しました。ステージ {stages[current_stage_index]['name']}, 世界 {current_world_index +1}")
-
-        # 画面描画
-        if not is_transitioning and game_running:
-            screen.fill(BLACK)
-
-            current_maze = current_world["maze"]
-            draw_maze(screen, current_maze)
-
-            # プレイヤー描画（アニメーション中は補間位置）
-            if is_moving:
-                screen.blit(player_img, (display_x * CELL_SIZE, display_y * CELL_SIZE))
-            else:
-                screen.blit(player_img, (player_x * CELL_SIZE, player_y * CELL_SIZE))
-
-            # ステータス表示（画面上部）
-            status_text = f"{current_stage['name']}|世界{current_world_index +1}|次の変化まで:{change_interval - move_count}回"
-            text_surface = font.render(status_text, True, BLACK)
-            screen.blit(text_surface, (10, BUTTON_MARGIN))
-
-            # リセットボタン描画（画面下部）
-            pygame.draw.rect(screen, button_color, button_rect)
-            button_text_surface = font.render(button_text, True, BLACK)
-            text_rect = button_text_surface.get_rect(center=button_rect.center)
-            screen.blit(button_text_surface, text_rect)
+                log.emit(DEBUG, event_log.FLIP_DONE, stage=stage.name, world=state.world + 1)
+                start_queued_move(transition_start_time + current_transition_duration)
 
+        # カメラはプレイヤー（アニメーション中は補間位置）を追いかける
+        if is_moving:
+            player_pos = (display_x, display_y)
+        else:
+            player_pos = (state.x, state.y)
+        camera = follow_camera(stage, player_pos[0], player_pos[1], CELL_SIZE, MAZE_VIEW_SIZE)
+        frame_profiler.mark(profiler.UPDATE)
+
+        # 背景の更新（世界の変化中は毎フレーム合成する）
+        if is_transitioning:
+            draw_transition_background()
+            invalidate_background()
+        elif background_key != (stage.name, state.world, camera):
+            draw_background(state.world, camera)
+            background_key = (stage.name, state.world, camera)
+        frame_profiler.mark(profiler.DRAW_MAZE)
+
+        # プレイヤー描画
+        items = [(player_img, (player_pos[0] * CELL_SIZE - camera[0], player_pos[1] * CELL_SIZE - camera[1]))]
+
+        # ステータス表示（画面上部）
+        # ステージ、世界、残り回数が変わったときだけ文字を作り直す
+        new_status_key = (stage.name, state.world, state.change_interval - state.move_count)
+        if new_status_key != status_key:
+            status_key = new_status_key
+            status_text = f"{stage.name}|世界{state.world +1}|次の変化まで:{state.change_interval - state.move_count}回"
+            status_surface = text_cache.render(font, status_text, BLACK)
+        items.append((status_surface, (10, BUTTON_MARGIN)))
+
+        if not is_transitioning:
             # ゲームクリアメッセージ
-            if game_clear:
-                clear_text = "クリア！おめでとうございます！"
-                clear_surface = font.render(clear_text, True, GREEN)
-                screen.blit(clear_surface, (SCREEN_WIDTH // 2 - clear_surface.get_width() // 2, SCREEN_HEIGHT // 2 - clear_surface.get_height() // 2))
-                unlock_next_stage()
+            if state.game_clear:
+                items.append((clear_surface, clear_pos))
 
             # 特殊マス到達メッセージの描画
             if special_message:
-                special_surface = font.render(special_message, True, YELLOW)
-                screen.blit(special_surface, (SCREEN_WIDTH // 2 - special_surface.get_width() // 2, SCREEN_HEIGHT - STATUS_HEIGHT + 10))
-
-        elif is_transitioning and game_running:
-            # アニメーション中の描画
-            if current_maze_surface and next_maze_surface:
-                screen.blit(current_maze_surface, (0, 0))
-                screen.blit(next_maze_surface, (0, 0))
-
-            # プレイヤー描画（アニメーション中は補間位置）
-            screen.blit(player_img, (player_x * CELL_SIZE, player_y * CELL_SIZE))
-
-            # ステータス表示（画面上部）
-            status_text = f"{current_stage['name']}|世界{current_world_index +1}|次の変化まで:{change_interval - move_count}回"
-            text_surface = font.render(status_text, True, BLACK)
-            screen.blit(text_surface, (10, BUTTON_MARGIN))
-
-            # リセットボタン描画（画面下部）
-            pygame.draw.rect(screen, button_color, button_rect)
-            button_text_surface = font.render(button_text, True, BLACK)
-            text_rect = button_text_surface.get_rect(center=button_rect.center)
-            screen.blit(button_text_surface, text_rect)
-
-        # メッセージタイマーの更新
-        if special_message:
-            special_message_timer -= dt
-            if special_message_timer <= 0:
-                special_message = ""
-
-        pygame.display.flip()
-
-    # フレームレート
-    pygame.time.Clock().tick(60)
+                special_surface = text_cache.render(font, special_message, YELLOW)
+                items.append((special_surface, (SCREEN_WIDTH // 2 - special_surface.get_width() // 2, SCREEN_HEIGHT - STATUS_HEIGHT + 10)))
+
+        # 計測結果の表示（一定間隔で作り直す）
+        if frame_profiler.enabled:
+            if profile_surface is None or scheduler.now - profile_surface_time >= PROFILE_OVERLAY_INTERVAL:
+                profile_surface = frame_profiler.render_overlay(font)
+                profile_surface_time = scheduler.now
+            items.append((profile_surface, (SCREEN_WIDTH - profile_surface.get_width(), STATUS_HEIGHT)))
+        frame_profiler.mark(profiler.TEXT)
+
+        # 変化した部分だけ画面に反映
+        dirty_rects = renderer.render(items)
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+        frame_profiler.mark(profiler.DISPLAY)
+    frame_profiler.end_frame()
+
+    # 次のフレームまで待つ
+    if is_moving or is_transitioning:
+        events = scheduler.wait_frame()
+    elif special_message:
+        # メッセージが消える時刻まではイベント待ち
+        events = scheduler.wait_events(special_message_timer)
+    else:
+        events = scheduler.wait_events()
@@ -0,0 +1,119 @@
+import json
+import os
+import time
+from array import array
+
+import pygame
+
+# フレームごとの処理時間の計測
+# 各フレームの開始時刻と処理段階ごとの時間をリングバッファ（固定長のarray）に記録する
+# 無効な間は各呼び出しがフラグを見て戻るだけ
+
+PHASES = ("events", "update", "draw_maze", "text", "display")
+PHASE_COLORS = ((120, 120, 255), (120, 255, 120), (255, 200, 80), (255, 120, 255), (255, 120, 120))
+EVENTS, UPDATE, DRAW_MAZE, TEXT, DISPLAY = range(len(PHASES))
+# 1フレーム分の記録: 開始時刻 + 段階ごとの秒数
+FIELDS = 1 + len(PHASES)
+
+TRACE_FILE = os.path.join("cache", "profile_trace.json")
+
+
+class FrameProfiler:
+    def __init__(self, capacity=600):
+        self.enabled = False
+        self.capacity = capacity
+        self.records = array('d', bytes(8 * FIELDS * capacity))
+        self.count = 0  # 記録したフレーム数（capacityを超えると古いものから上書き）
+        self.offset = 0
+        self.last_time = 0.0
+
+    # フレームの途中で有効にした場合は、その時点からフレームの計測を始める
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.begin_frame()
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.offset = (self.count % self.capacity) * FIELDS
+        self.records[self.offset] = now
+        for phase in range(len(PHASES)):
+            self.records[self.offset + 1 + phase] = 0.0
+        self.last_time = now
+
+    # 前回のmarkからの時間をphaseに加算する
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.records[self.offset + 1 + phase] += now - self.last_time
+        self.last_time = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.count += 1
+
+    # 記録に残っているフレーム（古い順）
+    def frames(self):
+        total = min(self.count, self.capacity)
+        first = self.count - total
+        for i in range(first, self.count):
+            offset = (i % self.capacity) * FIELDS
+            yield self.records[offset], self.records[offset + 1:offset + FIELDS]
+
+    # フレーム時間のパーセンタイル（ミリ秒）と、段階ごとの平均（ミリ秒）
+    def summary(self, percentiles=(50, 95, 99)):
+        totals = []
+        sums = [0.0] * len(PHASES)
+        for start, phases in self.frames():
+            totals.append(sum(phases))
+            for phase, seconds in enumerate(phases):
+                sums[phase] += seconds
+        if not totals:
+            return {}, [0.0] * len(PHASES)
+        totals.sort()
+        result = {p: totals[min(len(totals) - 1, len(totals) * p // 100)] * 1000 for p in percentiles}
+        return result, [seconds * 1000 / len(totals) for seconds in sums]
+
+    # 画面に重ねて表示する計測結果
+    def render_overlay(self, font, width=260, frame_budget_ms=1000 / 60):
+        percentiles, means = self.summary()
+        line_height = font.get_linesize()
+        surface = pygame.Surface((width, line_height * (len(PHASES) + 1) + 8), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 180))
+        text = " ".join(f"p{p}:{ms:.1f}" for p, ms in percentiles.items()) or "計測中"
+        surface.blit(font.render(text, True, (255, 255, 255)), (4, 4))
+        for phase, (name, mean) in enumerate(zip(PHASES, means)):
+            y = 4 + line_height * (phase + 1)
+            # 棒の長さは1フレームの目安時間に対する割合
+            bar_width = int(min(mean / frame_budget_ms, 1) * (width - 164))
+            pygame.draw.rect(surface, PHASE_COLORS[phase], (160, y + 3, max(bar_width, 1), line_height - 6))
+            surface.blit(font.render(name, True, (255, 255, 255)), (4, y))
+            surface.blit(font.render(f"{mean:.2f}", True, (255, 255, 255)), (104, y))
+        return surface
+
+    # Chromeのトレース形式（chrome://tracing、Perfetto）で書き出す
+    def export_chrome_trace(self, path=TRACE_FILE):
+        events = []
+        for frame_index, (start, phases) in enumerate(self.frames()):
+            t = start
+            for phase, seconds in enumerate(phases):
+                if seconds > 0:
+                    events.append({
+                        "name": PHASES[phase],
+                        "ph": "X",
+                        "ts": t * 1e6,
+                        "dur": seconds * 1e6,
+                        "pid": 1,
+                        "tid": 1,
+                        "args": {"frame": frame_index},
+                    })
+                t += seconds
+        trace_dir = os.path.dirname(path)
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+        with open(path, "w", encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+import pygame
+
+
+# 迷路の描画
+def draw_maze(surface, maze, tile_images, cell_size):
+    surface.blits([
+        (tile_images[cell], (x * cell_size, y * cell_size))
+        for y, row in enumerate(maze.tolist())
+        for x, cell in enumerate(row)
+    ], doreturn=False)
+
+
+# 迷路の画像をチャンク（chunk_size×chunk_sizeマス）ごとに描画してキャッシュする
+# 迷路（stage.grid）が差し替えられたときだけ描き直す。大きな迷路でも見えている部分しか描画しない
+class MazeCache:
+    def __init__(self, tile_images, cell_size, chunk_size=8, max_chunks=64):
+        self.tile_images = tile_images
+        self.cell_size = cell_size
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()
+
+    def get_chunk(self, stage, world, chunk_x, chunk_y):
+        key = (stage.name, world, chunk_x, chunk_y)
+        entry = self.chunks.get(key)
+        if entry is not None and entry[0] is stage.grid:
+            self.chunks.move_to_end(key)
+            return entry[1]
+        n = self.chunk_size
+        maze = stage.grid[world, chunk_y * n:(chunk_y + 1) * n, chunk_x * n:(chunk_x + 1) * n]
+        surface = pygame.Surface((maze.shape[1] * self.cell_size, maze.shape[0] * self.cell_size))
+        draw_maze(surface, maze, self.tile_images, self.cell_size)
+        self.chunks[key] = (stage.grid, surface)
+        self.chunks.move_to_end(key)
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return surface
+
+    # カメラ位置 (camera_x, camera_y)（ピクセル）から見える部分をsurfaceに描画
+    def draw_view(self, surface, stage, world, camera):
+        camera_x, camera_y = camera
+        view_width, view_height = surface.get_size()
+        chunk_pixels = self.chunk_size * self.cell_size
+        last_x = min((camera_x + view_width - 1) // chunk_pixels, (stage.width - 1) // self.chunk_size)
+        last_y = min((camera_y + view_height - 1) // chunk_pixels, (stage.height - 1) // self.chunk_size)
+        surface.blits([
+            (self.get_chunk(stage, world, chunk_x, chunk_y), (chunk_x * chunk_pixels - camera_x, chunk_y * chunk_pixels - camera_y))
+            for chunk_y in range(camera_y // chunk_pixels, last_y + 1)
+            for chunk_x in range(camera_x // chunk_pixels, last_x + 1)
+        ], doreturn=False)
+
+    def invalidate(self, stage_name=None):
+        if stage_name is None:
+            self.chunks.clear()
+        else:
+            for key in [key for key in self.chunks if key[0] == stage_name]:
+                del self.chunks[key]
+
+
+# プレイヤーを追いかけるカメラの位置（迷路の外は映さない。迷路が画面より小さい場合は左上に固定）
+def follow_camera(stage, x, y, cell_size, view_size):
+    view_width, view_height = view_size
+    camera_x = int(x * cell_size + cell_size // 2 - view_width // 2)
+    camera_y = int(y * cell_size + cell_size // 2 - view_height // 2)
+    camera_x = max(min(camera_x, stage.width * cell_size - view_width), 0)
+    camera_y = max(min(camera_y, stage.height * cell_size - view_height), 0)
+    return camera_x, camera_y
+
+
+# 背景と前景（プレイヤーや文字）を分けて描画し、変化した部分の矩形だけを返す
+class DirtyRenderer:
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = pygame.Surface(screen.get_size())
+        self.items = []
+        self.rects = []
+        self.full_update = True
+
+    # 背景が変わったときは画面全体を描き直す
+    def invalidate(self):
+        self.full_update = True
+
+    # items: (Surface, 位置) のリスト。前回と同じなら何もしない
+    def render(self, items):
+        if not self.full_update and items == self.items:
+            return []
+        if self.full_update:
+            self.screen.blit(self.background, (0, 0))
+            dirty = [self.screen.get_rect()]
+        else:
+            dirty = self.rects
+            for rect in self.rects:
+                self.screen.blit(self.background, rect, rect)
+        self.rects = [self.screen.blit(surface, pos) for surface, pos in items]
+        if not self.full_update:
+            dirty = dirty + self.rects
+        self.items = items
+        self.full_update = False
+        return dirty
@@ -0,0 +1,184 @@
+import argparse
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+import engine
+from history import History
+from level_pack import open_pack
+from levels import StageLoadError
+
+# 入力の記録と、画面なしでの高速再生
+# 受け付けた操作だけを (前の操作からのミリ秒, 操作, 引数) として可変長整数で記録する
+# 時刻はステージ開始（選択かリセット）からのミリ秒で、選択とリセットの操作自体は時刻0
+
+REPLAY_FILE = os.path.join("replays", "last.swr")
+REPLAY_MAGIC = b"SWRP"
+REPLAY_VERSION = 2
+# マジック、バージョン、ステージパックの内容のハッシュ、操作数
+REPLAY_HEADER = struct.Struct("<4sB32sI")
+
+# 操作（0〜3はengineの移動方向と同じ）
+UNDO = 4
+REDO = 5
+RESET = 6
+SELECT = 7  # 引数はステージ番号
+
+# time_ms: ステージ開始からのミリ秒
+Record = namedtuple("Record", ["time_ms", "code", "arg"])
+# clear_ms: クリアした手のステージ開始からのミリ秒
+ReplayResult = namedtuple("ReplayResult", ["stage_index", "state", "time_ms", "moves", "rejected", "clear_ms"])
+
+
+def write_varint(data, value):
+    if value < 0:
+        raise ValueError(f"負の値 {value} は記録できません。")
+    while value >= 0x80:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+# 操作の記録
+class ReplayRecorder:
+    def __init__(self, digest=bytes(32)):
+        self.digest = digest
+        self.data = bytearray()
+        self.count = 0
+        self.last_ms = 0
+
+    # time_ms: ステージ開始からのミリ秒（選択とリセットはステージの開始なので常に0）
+    def record(self, time_ms, code, arg=0):
+        if code == SELECT or code == RESET:
+            self.last_ms = time_ms = 0
+        write_varint(self.data, time_ms - self.last_ms)
+        self.data.append(code)
+        if code == SELECT:
+            write_varint(self.data, arg)
+        self.last_ms = time_ms
+        self.count += 1
+
+    def save(self, path=REPLAY_FILE):
+        replay_dir = os.path.dirname(path)
+        if replay_dir:
+            os.makedirs(replay_dir, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.digest, self.count))
+            f.write(self.data)
+
+
+# 記録ファイルの読み込み（ステージパックのハッシュと操作の一覧）
+def load_replay(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < REPLAY_HEADER.size:
+        raise ValueError(f"{path} はリプレイファイルではありません。")
+    magic, version, digest, count = REPLAY_HEADER.unpack_from(data, 0)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError(f"{path} はリプレイファイルではありません。")
+    records = []
+    offset = REPLAY_HEADER.size
+    time_ms = 0
+    for _ in range(count):
+        delta, offset = read_varint(data, offset)
+        code = data[offset]
+        offset += 1
+        time_ms = 0 if code == SELECT or code == RESET else time_ms + delta
+        arg = 0
+        if code == SELECT:
+            arg, offset = read_varint(data, offset)
+        records.append(Record(time_ms, code, arg))
+    return digest, records
+
+
+# 記録した操作をゲームのルールで再生する（アニメーションの待ち時間なし）
+def run_replay(records, stages):
+    stage_index = None
+    stage = None
+    state = None
+    history = None
+    moves = 0
+    rejected = 0
+    clear_ms = None
+    time_ms = 0
+    for time_ms, code, arg in records:
+        if code == SELECT or code == RESET:
+            if code == SELECT:
+                stage_index = arg
+            if stage_index is None or stage_index >= len(stages):
+                rejected += 1
+                continue
+            stage = stages[stage_index]
+            state = engine.initial_state(stage)
+            history = History(stage, state)
+            clear_ms = None
+        elif stage is None:
+            rejected += 1
+        elif code == UNDO:
+            if history.can_undo() and not state.game_clear:
+                state = history.undo()
+            else:
+                rejected += 1
+        elif code == REDO:
+            if history.can_redo() and not state.game_clear:
+                state = history.redo()
+            else:
+                rejected += 1
+        elif engine.check_move(stage, state, code) == engine.MOVE_OK:
+            state = engine.apply_move(stage, state, code)
+            history.push(code, state)
+            moves += 1
+            if state.game_clear:
+                clear_ms = time_ms
+        else:
+            rejected += 1
+    return ReplayResult(stage_index, state, time_ms, moves, rejected, clear_ms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="リプレイファイルを画面なしで再生する")
+    parser.add_argument("replays", nargs="*", default=[REPLAY_FILE])
+    parser.add_argument("--worlds", default="Worlds")
+    parser.add_argument("--quiet", action="store_true", help="最後に集計だけ表示する")
+    args = parser.parse_args()
+    try:
+        stages = open_pack(args.worlds)
+    except StageLoadError as e:
+        print(e)
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    for path in args.replays:
+        try:
+            digest, records = load_replay(path)
+            result = run_replay(records, stages)
+        except (OSError, ValueError, StageLoadError) as e:
+            print(f"{path}: {e}")
+            continue
+        if args.quiet:
+            continue
+        if digest != stages.digest:
+            print(f"{path}: 記録時とステージが変更されています。")
+        if result.state is None:
+            print(f"{path}: ステージが選択されていません。")
+            continue
+        state = result.state
+        print(f"{path}: ステージ {stages.names[result.stage_index]}, 世界 {state.world + 1}, "
+              f"プレイヤー位置 ({state.x}, {state.y}), {result.moves}手, 無効な操作 {result.rejected}, "
+              f"{f'クリア ({result.clear_ms / 1000:.3f}秒)' if state.game_clear else '未クリア'}")
+    elapsed = time.perf_counter() - start_time
+    print(f"{len(args.replays)}件を{elapsed:.3f}秒で再生しました。")
@@ -0,0 +1,109 @@
+import copy
+import json
+import os
+import threading
+import time
+
+# セーブデータの読み書き
+# 書き込みは別スレッドで行い、短い間に何度保存しても最後の内容を1回だけ書く
+# 一時ファイルに書いてからos.replaceで置き換えるので、書き込み中に落ちても前の内容が残る
+
+SAVE_FILE = "save.json"
+SAVE_DELAY = 0.5  # 保存要求から書き込みまで待つ秒数（この間の保存要求はまとめる）
+
+
+# 初期状態のセーブデータ
+# stages: ステージ名ごとの {"best_moves": 最短手数, "best_time": 最短クリア時間（秒）, "clears": クリア回数}
+def default_save():
+    return {"unlocked_stage": 1, "stages": {}}
+
+
+# セーブデータの読み込み（壊れている場合は初期状態から始める）
+def load_save(path=SAVE_FILE):
+    data = default_save()
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            loaded = json.load(f)
+    except FileNotFoundError:
+        return data
+    except (OSError, ValueError) as e:
+        print(f"{path} を読み込めません: {e}")
+        return data
+    if isinstance(loaded, dict):
+        data.update(loaded)
+    return data
+
+
+# 一時ファイルに書いてから置き換える
+def write_save(data, path=SAVE_FILE):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+# ステージクリアの記録（記録を更新したらTrue。movesとsecondsがNoneならクリアの回数だけ数える）
+def record_clear(data, stage_name, moves, seconds):
+    record = data["stages"].setdefault(stage_name, {"best_moves": None, "best_time": None, "clears": 0})
+    record["clears"] += 1
+    if moves is None:
+        return False
+    improved = False
+    if record["best_moves"] is None or moves < record["best_moves"]:
+        record["best_moves"] = moves
+        improved = True
+    if record["best_time"] is None or seconds < record["best_time"]:
+        record["best_time"] = round(seconds, 3)
+        improved = True
+    return improved
+
+
+class SaveWriter:
+    def __init__(self, path=SAVE_FILE, delay=SAVE_DELAY):
+        self.path = path
+        self.delay = delay
+        self.lock = threading.Lock()  # pendingの受け渡し用（書き込み中もsaveを待たせない）
+        self.write_lock = threading.Lock()
+        self.pending = None
+        self.requested = threading.Event()
+        self.closed = False
+        self.writes = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # 保存の要求（内容は複製するので、呼び出し後にdataを変更してよい）
+    def save(self, data):
+        snapshot = copy.deepcopy(data)
+        with self.lock:
+            self.pending = snapshot
+        self.requested.set()
+
+    def run(self):
+        while not self.closed:
+            self.requested.wait()
+            # 少し待って、その間の保存要求をまとめる
+            time.sleep(self.delay)
+            self.requested.clear()
+            self.flush()
+
+    # 保存待ちの内容をすぐに書き込む
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                data = self.pending
+                self.pending = None
+            if data is None:
+                return
+            try:
+                write_save(data, self.path)
+                self.writes += 1
+            except OSError as e:
+                print(f"{self.path} に保存できません: {e}")
+
+    # 終了時の書き込み
+    def close(self):
+        self.closed = True
+        self.requested.set()
+        self.flush()
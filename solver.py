@@ -0,0 +1,131 @@
+import sys
+
+import engine
+from levels import WALL, START, GOAL, PLUS, MINUS, StageLoadError, load_stages
+
+# 最短手順ソルバー
+# 状態は (世界, y, x, 残り手数r)。r = change_interval - move_count
+# 状態の番号は stage.cells 上の位置 * (最大間隔+1) + r
+# +マスはrを変えず、-マスはrを2減らし、それ以外のマスは1減らす。r <= 0で世界が変化する
+# （-マスでchange_intervalが1のままでもr <= 0になるので結果は同じ）
+# rは世界の変化時にしか増えないので、状態数は 世界数*H*W*(最大間隔+1) に収まる
+
+# 各状態の記録（1バイト）
+VISITED = 0x80
+CHANGED = 0x40   # 世界の変化で到達した
+ROOT = 0x20      # 開始状態
+# 下位2ビットは到達した行動、世界の変化で到達した場合は2-3ビットに変化前のr
+
+# 行動とキーの対応（表示用）
+ACTION_KEYS = "wsad"
+
+
+# セルの種類ごとのrの減り方
+CELL_WEIGHTS = {PLUS: 0, MINUS: 2}
+
+
+def cell_weight(cell):
+    return CELL_WEIGHTS.get(cell, 1)
+
+
+# load_stages()のステージの最短手順を求める（クリアできない場合はNone）
+def solve(stage):
+    if stage.start is None:
+        raise StageLoadError(f"{stage.name}のworld1.txtにスタート位置 'S' が見つかりません。")
+    worlds = len(stage.intervals)
+    width = stage.width
+    height = stage.height
+    world_size = width * height
+    r_size = max(max(stage.intervals), 0) + 1
+    intervals = [max(interval, 0) for interval in stage.intervals]
+    cells = stage.cells
+    lock_start = stage.lock_start
+    marks = bytearray(len(cells) * r_size)
+
+    x, y = stage.start
+    start = (y * width + x) * r_size + intervals[0]
+    marks[start] = VISITED | ROOT
+    frontier = [start]
+    while frontier:
+        next_frontier = []
+        for index in frontier:
+            r = index % r_size
+            position = index // r_size
+            x = position % width
+            y = position // width % height
+            for action, (dx, dy) in enumerate(engine.DIRECTIONS):
+                new_x = x + dx
+                new_y = y + dy
+                if new_y < 0 or new_y >= height or new_x < 0 or new_x >= width:
+                    continue
+                new_position = position + dy * width + dx
+                cell = cells[new_position]
+                if cell == WALL or (lock_start and cell == START):
+                    continue
+                if cell == GOAL:
+                    return trace_path(stage, marks, index) + [action]
+                new_r = r - cell_weight(cell)
+                if new_r > 0:
+                    new_index = new_position * r_size + new_r
+                    mark = VISITED | action
+                else:
+                    new_world = (position // world_size + 1) % worlds
+                    new_position = new_world * world_size + new_y * width + new_x
+                    if cells[new_position] == WALL:
+                        continue  # 壁に埋まる
+                    new_index = new_position * r_size + intervals[new_world]
+                    mark = VISITED | CHANGED | (r << 2) | action
+                if marks[new_index]:
+                    continue
+                marks[new_index] = mark
+                next_frontier.append(new_index)
+        frontier = next_frontier
+    return None
+
+
+# 記録をたどって開始状態からの手順を復元
+def trace_path(stage, marks, index):
+    worlds = len(stage.intervals)
+    width = stage.width
+    world_size = width * stage.height
+    r_size = max(max(stage.intervals), 0) + 1
+    path = []
+    while not marks[index] & ROOT:
+        mark = marks[index]
+        action = mark & 3
+        r = index % r_size
+        position = index // r_size
+        dx, dy = engine.DIRECTIONS[action]
+        if mark & CHANGED:
+            world = position // world_size
+            position += ((world - 1) % worlds - world) * world_size
+            prev_r = (mark >> 2) & 3
+        else:
+            prev_r = r + cell_weight(stage.cells[position])
+        path.append(action)
+        index = (position - dy * width - dx) * r_size + prev_r
+    path.reverse()
+    return path
+
+
+def format_actions(actions):
+    return "".join(ACTION_KEYS[action] for action in actions)
+
+
+if __name__ == "__main__":
+    worlds_folder = sys.argv[1] if len(sys.argv) > 1 else "Worlds"
+    try:
+        stages = load_stages(worlds_folder)
+    except StageLoadError as e:
+        print(e)
+        sys.exit(1)
+    for stage in stages:
+        try:
+            actions = solve(stage)
+        except StageLoadError as e:
+            print(e)
+            continue
+        if actions is None:
+            print(f"{stage.name}: クリアできません")
+        else:
+            print(f"{stage.name}: {len(actions)}手 {format_actions(actions)}")
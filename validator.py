@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import hints
+import solver
+from level_pack import MAX_INTERVAL, MAX_SIZE, MIN_INTERVAL
+from levels import CELL_CODES, StageLoadError, build_stage, list_stage_files, read_world
+
+# ステージの検証（Worlds/ のすべてのステージをプロセスプールで並列に調べる）
+# errorsがあるステージは不合格。warningsはゲームでは動くが意図していない可能性があるもの（--strictで不合格にする）
+
+# 迷路の大きさの上限（既定はステージパックに入る大きさ。投稿を小さく制限したい場合は --max-width/--max-height で指定する）
+MAX_WIDTH = MAX_SIZE
+MAX_HEIGHT = MAX_SIZE
+
+
+# 迷路の行の検査（ゲームの読み込みと同じく末尾の空行は無視する）
+def check_rows(world_name, rows, max_width, max_height, errors, warnings):
+    while rows and not rows[-1]:
+        rows = rows[:-1]
+    if not rows:
+        errors.append(f"{world_name}: 迷路がありません。")
+        return
+    widths = {len(row) for row in rows}
+    if len(widths) > 1:
+        warnings.append(f"{world_name}: 行の長さがそろっていません（{min(widths)}〜{max(widths)}文字）。短い行は壁で埋められます。")
+    if max(widths) > max_width or len(rows) > max_height:
+        errors.append(f"{world_name}: 迷路が大きすぎます（{max(widths)}x{len(rows)}、上限 {max_width}x{max_height}）。")
+    for y, row in enumerate(rows):
+        unknown = sorted({cell for cell in row if cell not in CELL_CODES})
+        if unknown:
+            errors.append(f"{world_name}: {y + 2}行目に未定義の文字 {''.join(unknown)!r} があります。")
+
+
+# 1ステージの検査（最短手順の手数を返す。調べなかった場合はNone）
+def check_stage(stage_index, stage_name, world_paths, max_width, max_height, solve, errors, warnings):
+    worlds = []
+    for world_path in world_paths:
+        world_name = os.path.basename(world_path)
+        try:
+            change_interval, rows = read_world(world_path)
+        except StageLoadError as e:
+            errors.append(str(e))
+            continue
+        except (OSError, UnicodeDecodeError) as e:
+            errors.append(f"{world_path} を読み込めません: {e}")
+            continue
+        if not MIN_INTERVAL <= change_interval <= MAX_INTERVAL:
+            errors.append(f"{world_name}: 変化までの回数 {change_interval} は範囲外です（{MIN_INTERVAL}〜{MAX_INTERVAL}）。")
+        elif change_interval < 1:
+            warnings.append(f"{world_name}: 変化までの回数が{change_interval}です。1手ごとに世界が変化します。")
+        check_rows(world_name, rows, max_width, max_height, errors, warnings)
+        worlds.append((change_interval, rows))
+
+    if not world_paths:
+        errors.append("世界ファイル（world*.txt）がありません。")
+    if errors:
+        return None
+    stage = build_stage(stage_name, worlds, stage_index)
+    if stage.start is None:
+        errors.append("world1.txtにスタート位置 'S' がありません。")
+    elif len(stage.goals) == 0:
+        errors.append("ゴール 'G' がありません。")
+    elif solve:
+        # 状態が多すぎるステージはメモリが足りなくなるので調べない（ヒントも使えない大きさ）
+        states = hints.state_count(stage)
+        if states > hints.MAX_STATES:
+            warnings.append(f"状態数が{states}で上限 {hints.MAX_STATES} を超えるため、ゴールに到達できるかを調べていません。")
+            return None
+        actions = solver.solve(stage)
+        if actions is None:
+            errors.append("ゴールに到達できません。")
+        else:
+            return len(actions)
+    return None
+
+
+# 1ステージの検証（プロセスプールから呼ばれる。想定外の例外もそのステージのエラーとして報告する）
+def validate_stage(task):
+    stage_index, stage_name, world_paths, max_width, max_height, solve = task
+    start_time = time.perf_counter()
+    errors = []
+    warnings = []
+    try:
+        solution = check_stage(stage_index, stage_name, world_paths, max_width, max_height, solve, errors, warnings)
+    except Exception as e:
+        errors.append(f"検証中にエラーが起きました: {type(e).__name__}: {e}")
+        solution = None
+
+    return {
+        "index": stage_index,
+        "stage": stage_name,
+        "ok": not errors,
+        "errors": errors,
+        "warnings": warnings,
+        "solution_length": solution,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+# すべてのステージの検証（jobsがNoneならCPUの数だけプロセスを使う）
+def validate_folder(worlds_folder="Worlds", jobs=None, max_width=MAX_WIDTH, max_height=MAX_HEIGHT, solve=True):
+    stage_files = list_stage_files(worlds_folder)
+    tasks = [(index, stage_name, world_paths, max_width, max_height, solve) for index, (stage_name, world_paths) in enumerate(stage_files)]
+    jobs = jobs or os.cpu_count() or 1
+    start_time = time.perf_counter()
+    if jobs == 1 or len(tasks) <= 1:
+        results = [validate_stage(task) for task in tasks]
+    else:
+        # 小さいステージが大量にある場合に備えて、まとめてプロセスに渡す
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(validate_stage, tasks, chunksize=chunksize))
+    return {
+        "worlds_folder": worlds_folder,
+        "jobs": jobs,
+        "stages": results,
+        "failed": sum(1 for result in results if not result["ok"]),
+        "warned": sum(1 for result in results if result["warnings"]),
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worlds/ のステージを検証する")
+    parser.add_argument("worlds_folder", nargs="?", default="Worlds")
+    parser.add_argument("-j", "--jobs", type=int, help="並列に動かすプロセス数（既定はCPUの数）")
+    parser.add_argument("-o", "--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで標準出力に出す")
+    parser.add_argument("--max-width", type=int, default=MAX_WIDTH, help="迷路の幅の上限（既定はステージパックの上限）")
+    parser.add_argument("--max-height", type=int, default=MAX_HEIGHT, help="迷路の高さの上限（既定はステージパックの上限）")
+    parser.add_argument("--no-solve", action="store_true", help="ゴールに到達できるかを調べない")
+    parser.add_argument("--strict", action="store_true", help="警告があるステージも不合格にする")
+    args = parser.parse_args()
+    try:
+        report = validate_folder(args.worlds_folder, args.jobs, args.max_width, args.max_height, not args.no_solve)
+    except StageLoadError as e:
+        print(e)
+        sys.exit(2)
+
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=4))
+    else:
+        for result in report["stages"]:
+            if result["ok"] and not result["warnings"]:
+                continue
+            for message in result["errors"]:
+                print(f"{result['stage']}: エラー: {message}")
+            for message in result["warnings"]:
+                print(f"{result['stage']}: 警告: {message}")
+        print(f"{len(report['stages'])}ステージ中 {report['failed']}ステージが不合格、"
+              f"{report['warned']}ステージに警告（{report['jobs']}プロセス、{report['seconds']:.2f}秒）")
+
+    failed = report["failed"] + (report["warned"] if args.strict else 0)
+    sys.exit(1 if failed else 0)
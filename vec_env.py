@@ -0,0 +1,127 @@
+import itertools
+
+import numpy as np
+
+import engine
+from levels import WALL, START, GOAL, PLUS, MINUS, StageLoadError
+
+# 複数のゲームをまとめて進める（自動テストや学習用のエージェント向け）
+# engine.step と同じルールを、1つのステージのN個のゲームに対してnumpyの配列演算で適用する
+# 状態はフィールドごとの配列で持ち、観測は (N, OBS_FIELDS) のint32配列で返す
+
+# 観測の列（engine.Stateと同じ並び）
+OBS_FIELDS = engine.State._fields
+X, Y, WORLD, MOVE_COUNT, CHANGE_INTERVAL, IS_STUCK, GAME_CLEAR = range(len(OBS_FIELDS))
+
+DX = np.array([dx for dx, dy in engine.DIRECTIONS], dtype=np.int32)
+DY = np.array([dy for dx, dy in engine.DIRECTIONS], dtype=np.int32)
+
+
+class VecEnv:
+    # auto_reset: クリアしたゲームと埋まったゲームは、その手の結果を返した後に開始状態に戻す
+    def __init__(self, stage, num_envs, auto_reset=False):
+        if stage.start is None:
+            raise StageLoadError(f"{stage.name}のworld1.txtにスタート位置 'S' が見つかりません。")
+        self.stage = stage
+        self.num_envs = num_envs
+        self.auto_reset = auto_reset
+        self.cells = np.frombuffer(stage.cells, dtype=np.uint8)
+        self.intervals = np.array(stage.intervals, dtype=np.int32)
+        self.widths = np.array([width for width, height in stage.sizes], dtype=np.int32)
+        self.heights = np.array([height for width, height in stage.sizes], dtype=np.int32)
+        self.x = np.zeros(num_envs, dtype=np.int32)
+        self.y = np.zeros(num_envs, dtype=np.int32)
+        self.world = np.zeros(num_envs, dtype=np.int32)
+        self.move_count = np.zeros(num_envs, dtype=np.int32)
+        self.change_interval = np.zeros(num_envs, dtype=np.int32)
+        self.is_stuck = np.zeros(num_envs, dtype=bool)
+        self.game_clear = np.zeros(num_envs, dtype=bool)
+        self.reset()
+
+    # 開始状態に戻す（maskを指定した場合はそのゲームだけ）
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        start_x, start_y = self.stage.start
+        self.x[mask] = start_x
+        self.y[mask] = start_y
+        self.world[mask] = 0
+        self.move_count[mask] = 0
+        self.change_interval[mask] = self.intervals[0]
+        self.is_stuck[mask] = False
+        self.game_clear[mask] = False
+        return self.observe()
+
+    # 各ゲームの状態をengine.Stateのリストから設定する（リストの長さはnum_envs）
+    def load(self, states):
+        fields = np.fromiter(itertools.chain.from_iterable(states), dtype=np.int32, count=self.num_envs * len(OBS_FIELDS))
+        fields = fields.reshape(self.num_envs, len(OBS_FIELDS))
+        self.x = fields[:, X].copy()
+        self.y = fields[:, Y].copy()
+        self.world = fields[:, WORLD].copy()
+        self.move_count = fields[:, MOVE_COUNT].copy()
+        self.change_interval = fields[:, CHANGE_INTERVAL].copy()
+        self.is_stuck = fields[:, IS_STUCK].astype(bool)
+        self.game_clear = fields[:, GAME_CLEAR].astype(bool)
+        return self.observe()
+
+    def observe(self):
+        return np.stack([self.x, self.y, self.world, self.move_count, self.change_interval, self.is_stuck, self.game_clear], axis=1)
+
+    # 全ゲームを1手進める（観測、移動判定の結果、その手でクリアしたか、その手で埋まったか）
+    def step(self, actions):
+        actions = np.asarray(actions)
+        stage = self.stage
+        cells = self.cells
+        new_x = self.x + DX[actions]
+        new_y = self.y + DY[actions]
+        world = self.world
+
+        # 移動判定（engine.check_moveと同じ優先順）
+        in_bounds = (new_x >= 0) & (new_x < self.widths[world]) & (new_y >= 0) & (new_y < self.heights[world])
+        cell = cells[(world * stage.height + np.clip(new_y, 0, stage.height - 1)) * stage.width + np.clip(new_x, 0, stage.width - 1)]
+        result = np.full(self.num_envs, engine.MOVE_OK, dtype=np.int8)
+        if stage.lock_start:
+            result[in_bounds & (cell == START)] = engine.BLOCKED_START
+        result[in_bounds & (cell == WALL)] = engine.BLOCKED_WALL
+        result[~in_bounds] = engine.BLOCKED_BOUNDS
+        result[self.is_stuck] = engine.BLOCKED_STUCK
+        result[self.game_clear] = engine.BLOCKED_CLEAR
+        ok = result == engine.MOVE_OK
+
+        # 移動の確定（engine.apply_moveと同じ）
+        self.x = np.where(ok, new_x, self.x)
+        self.y = np.where(ok, new_y, self.y)
+        move_count = self.move_count + ok
+        change_interval = self.change_interval + (ok & (cell == PLUS))
+        change_interval -= ok & (cell == MINUS) & (change_interval > 1)
+        clear = ok & (cell == GOAL)
+
+        # 世界の変化
+        flip = ok & ~clear & (move_count >= change_interval)
+        new_world = np.where(flip, (world + 1) % len(stage.intervals), world)
+        self.move_count = np.where(flip, 0, move_count)
+        self.change_interval = np.where(flip, self.intervals[new_world], change_interval)
+        stuck = flip & engine.stuck_after_change(stage, world, self.x, self.y)
+        self.world = new_world
+        self.is_stuck |= stuck
+        self.game_clear |= clear
+
+        observations = self.observe()
+        if self.auto_reset:
+            done = self.game_clear | self.is_stuck
+            if done.any():
+                self.reset(done)
+        return observations, result, clear, stuck
+
+    # 全ゲームの状態（engine.Stateのリスト）
+    def states(self):
+        fields = (self.x, self.y, self.world, self.move_count, self.change_interval, self.is_stuck, self.game_clear)
+        return list(map(engine.State._make, zip(*(values.tolist() for values in fields))))
+
+    # i番目のゲームの状態（engine.State）
+    def state(self, index):
+        return engine.State(
+            int(self.x[index]), int(self.y[index]), int(self.world[index]), int(self.move_count[index]),
+            int(self.change_interval[index]), bool(self.is_stuck[index]), bool(self.game_clear[index]),
+        )